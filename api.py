@@ -0,0 +1,222 @@
+"""Quota-bewusster Zugriff auf Sheets und Drive.
+
+Jeder Call läuft durch ``Api.call``:
+
+* ein prozessweiter Token-Bucket pro Dienst, abgestimmt auf das Minuten-Kontingent,
+* exponentielles Backoff mit Jitter bei 429/5xx und Verbindungsfehlern; nicht idempotente
+  Writes (Append, Datei anlegen) nach 5xx/Timeout nur, wenn ``verify`` zeigt, dass nichts ankam,
+* Single-Flight für identische Lesezugriffe: zehn Sessions, ein Request,
+* Fehler werden als ``ApiError`` mit Art (``kind``) weitergereicht statt verschluckt.
+
+``SpreadsheetProxy`` und ``DriveProxy`` legen das transparent um ``sh`` bzw. den
+Drive-Client, der restliche Code ruft sie wie gewohnt auf.
+"""
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+# Sheets: 60 Requests/Minute pro Nutzer (der Service-Account ist ein Nutzer)
+SHEETS_PER_MINUTE = 60
+DRIVE_PER_MINUTE = 600
+
+RETRYABLE = ("quota", "transient")
+
+KIND_TEXT = {
+    "quota": "Google-Quota erschöpft",
+    "transient": "Google-Dienst vorübergehend nicht erreichbar",
+    "auth": "Keine Berechtigung",
+    "not_found": "Nicht gefunden",
+    "client": "Ungültige Anfrage",
+    "unknown": "Unbekannter Fehler",
+}
+
+
+class ApiError(Exception):
+    """Klassifizierter Fehler eines Sheets/Drive-Calls."""
+
+    def __init__(self, op, kind, status=None, cause=None):
+        self.op = op
+        self.kind = kind
+        self.status = status
+        self.cause = cause
+        super().__init__(f"{KIND_TEXT[kind]} ({op}{f', HTTP {status}' if status else ''})")
+
+    @property
+    def retryable(self):
+        return self.kind in RETRYABLE
+
+
+def _status(exc):
+    resp = getattr(exc, "response", None)  # gspread.APIError / requests
+    if getattr(resp, "status_code", None): return int(resp.status_code)
+    resp = getattr(exc, "resp", None)  # googleapiclient.errors.HttpError
+    if getattr(resp, "status", None): return int(resp.status)
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) and code > 0 else None
+
+def classify(exc):
+    """(kind, status) für eine Exception aus gspread, googleapiclient oder dem Netzwerk."""
+    if isinstance(exc, ApiError): return exc.kind, exc.status
+    status = _status(exc)
+    text = str(exc)
+    if status == 429: return "quota", status
+    if status == 403 and ("rateLimitExceeded" in text or "RATE_LIMIT" in text or "quota" in text.lower()): return "quota", status
+    if status in (401, 403): return "auth", status
+    if status == 404: return "not_found", status
+    if status and status >= 500: return "transient", status
+    if status and status >= 400: return "client", status
+    if isinstance(exc, (ConnectionError, TimeoutError, OSError)): return "transient", status
+    return "unknown", status
+
+
+class TokenBucket:
+    """Prozessweiter Token-Bucket: ``per_minute`` Requests, bis zu ``burst`` auf einmal."""
+
+    def __init__(self, per_minute, burst=10):
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1; return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Api:
+
+    def __init__(self, buckets=None, retries=5, base=0.5, cap=32.0):
+        self.buckets = buckets or {"sheets": TokenBucket(SHEETS_PER_MINUTE), "drive": TokenBucket(DRIVE_PER_MINUTE, burst=20)}
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def call(self, service, op, fn, key=None, idempotent=True, verify=None):
+        """Führt ``fn()`` gedrosselt und mit Retries aus; gleiche ``key``s teilen sich einen Request.
+
+        Bei ``idempotent=False`` wird ein 429 wiederholt (Google hat nichts ausgeführt), ein
+        5xx/Timeout aber nur, wenn ``verify()`` None liefert; sonst ist dessen Ergebnis die Antwort.
+        """
+        if key is None: return self._run(service, op, fn, idempotent, verify)
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader: fut = self._inflight[key] = Future()
+        if not leader:
+            metrics.count("api.coalesced")
+            return fut.result()
+        try:
+            fut.set_result(self._run(service, op, fn))
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+        return fut.result()
+
+    def _run(self, service, op, fn, idempotent=True, verify=None):
+        bucket = self.buckets.get(service)
+        for attempt in range(self.retries + 1):
+            if bucket:
+                with metrics.span(f"throttle.{service}"): bucket.acquire()
+            metrics.count("api.calls"); metrics.count(f"api.{service}")
+            try:
+                with metrics.span(op): return fn()
+            except Exception as e:
+                kind, status = classify(e)
+                metrics.count(f"api.error.{kind}")
+                retry = kind == "quota" or (kind == "transient" and (idempotent or verify is not None))
+                if not retry or attempt == self.retries:
+                    raise ApiError(op, kind, status, e) from e
+                if kind == "transient" and not idempotent:
+                    # der Write kann trotz Fehler angekommen sein: erst nachsehen, dann wiederholen
+                    try: found = verify()
+                    except Exception: raise ApiError(op, kind, status, e) from e
+                    if found is not None:
+                        metrics.count("api.verified"); return found
+                # "Full Jitter": zufällige Wartezeit bis zur exponentiellen Obergrenze
+                time.sleep(random.uniform(0, min(self.cap, self.base * 2 ** attempt)))
+
+
+# --- PROXIES ---
+
+class SpreadsheetProxy:
+    """Reicht alle Methoden von ``gspread.Spreadsheet`` durch ``Api.call`` durch."""
+
+    READS = {"values_batch_get", "values_get", "fetch_sheet_metadata"}
+    # ein wiederholter Append hängt die Zeilen ein zweites Mal an
+    NOT_IDEMPOTENT = {"values_append"}
+
+    def __init__(self, sh, api):
+        self._sh = sh
+        self._api = api
+
+    def __getattr__(self, name):
+        attr = getattr(self._sh, name)
+        if not callable(attr): return attr
+        def wrapped(*args, **kwargs):
+            key = ("sheets", self._sh.id, name, repr(args), repr(sorted(kwargs.items()))) if name in self.READS else None
+            return self._api.call("sheets", f"sheets.{name}", lambda: attr(*args, **kwargs), key=key,
+                                  idempotent=name not in self.NOT_IDEMPOTENT)
+        return wrapped
+
+
+class DriveProxy:
+    """Wie der Drive-Client (``files().list(...).execute()``), aber jeder ``execute`` über ``Api.call``."""
+
+    READS = {"list", "get", "get_media"}
+    NOT_IDEMPOTENT = {"create", "copy"}
+
+    def __init__(self, service, api):
+        self._service = service
+        self._api = api
+
+    def files(self):
+        return _Resource(self, self._service.files(), "files")
+
+
+class _Resource:
+
+    def __init__(self, proxy, resource, name):
+        self._proxy = proxy
+        self._resource = resource
+        self._name = name
+
+    def __getattr__(self, method):
+        build = getattr(self._resource, method)
+        def make(**kwargs):
+            op = f"drive.{self._name}.{method}"
+            key = (op, repr(sorted(kwargs.items()))) if method in DriveProxy.READS else None
+            return _Request(self._proxy, build(**kwargs), op, key)
+        return make
+
+
+class _Request:
+
+    def __init__(self, proxy, request, op, key):
+        self._proxy = proxy
+        self._request = request
+        self.op = op
+        self.key = key
+
+    def execute(self, verify=None):
+        """``verify`` wie bei ``Api.call``: findet nach einem 5xx das doch angelegte Ergebnis."""
+        # httplib2 ist nicht thread-sicher: jeder Thread bekommt eine eigene Verbindung
+        service = self._proxy._service
+        http = service.http() if hasattr(service, "http") else None
+        fn = (lambda: self._request.execute(http=http)) if http else self._request.execute
+        method = self.op.rsplit(".", 1)[-1]
+        return self._proxy._api.call("drive", self.op, fn, key=self.key,
+                                     idempotent=method not in DriveProxy.NOT_IDEMPOTENT, verify=verify)
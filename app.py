@@ -2,18 +2,37 @@ import streamlit as st
 import pandas as pd
 import gspread
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import datetime
+import functools
+import logging
 import time
-import os
-import openpyxl
-from openpyxl.cell.cell import MergedCell
-from openpyxl.styles import Font, Color # Für die roten Sternchen
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
+import api
+import archive
+import db
+import drive
+import excel
+import export
+import metrics
+import replica
+import search
+import setlist
+import stats
+
+T_START = time.perf_counter()
+log = logging.getLogger("gema")
+if not log.handlers:
+    # Eine Zeile pro Eintrag; gema.metrics schreibt pro Rerun ein JSON-Objekt
+    _h = logging.StreamHandler(); _h.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_h); log.setLevel(logging.INFO)
+
 # --- KONFIGURATION ---
 DB_NAME = "GEMA_Datenbank"
+REPLICA_PATH = "gema_replica.sqlite" # lokale Kopie der Tabelle; leer = nur im Speicher
 
 st.set_page_config(page_title="GEMA Manager", page_icon="xj", layout="centered")
 
@@ -30,331 +49,310 @@ def reset_draft_logic(keep_download=False):
     
     if not keep_download:
         st.session_state.last_download = None
-        st.session_state.uploaded_file_link = None
+        st.session_state.upload_job = None
 
 if 'gig_draft' not in st.session_state: reset_draft_logic()
 if 'gig_song_selector' not in st.session_state: st.session_state.gig_song_selector = []
 if 'rep_edit_state' not in st.session_state: st.session_state.rep_edit_state = {"id": None, "titel": "", "dauer": "", "kn": "", "kv": "", "bn": "", "bv": "", "verlag": ""}
-if 'page' not in st.session_state: st.session_state.page = "speichern"
-if 'db_checked' not in st.session_state: st.session_state.db_checked = False
+# Versteckte Admin-Seite: ?admin=perf
+if 'page' not in st.session_state: st.session_state.page = "perf" if st.query_params.get("admin") == "perf" else "speichern"
 if 'last_download' not in st.session_state: st.session_state.last_download = None
-if 'uploaded_file_link' not in st.session_state: st.session_state.uploaded_file_link = None
+if 'upload_job' not in st.session_state: st.session_state.upload_job = None
+if 'save_error' not in st.session_state: st.session_state.save_error = None
 if 'trigger_reset' not in st.session_state: st.session_state.trigger_reset = False
 
+st.session_state.metrics_run = metrics.begin_run(st.session_state.get("metrics_run"), page=st.session_state.page)
+
+# Nach "Fertigstellen": Entwurf leeren, bevor irgendein Widget gebaut wird
 if st.session_state.trigger_reset:
     reset_draft_logic(keep_download=True)
     st.session_state.trigger_reset = False
-    st.rerun()
 
 # --- NAVIGATION ---
+def go_to(page):
+    st.session_state.page = page
+
 def navigation_bar():
+    # on_click läuft vor dem Skript: die Seite stimmt sofort, ohne zweiten Rerun
     st.markdown("---")
     c1, c2, c3, c4 = st.columns(4)
-    if c1.button("💾 Speichern / Edit", use_container_width=True, type="primary" if st.session_state.page == "speichern" else "secondary"): 
-        st.session_state.page = "speichern"; st.rerun()
-    if c2.button("🎵 Repertoire", use_container_width=True, type="primary" if st.session_state.page == "repertoire" else "secondary"): 
-        st.session_state.page = "repertoire"; st.rerun()
-    if c3.button("📍 Orte", use_container_width=True, type="primary" if st.session_state.page == "orte" else "secondary"): 
-        st.session_state.page = "orte"; st.rerun()
-    if c4.button("📂 Archiv", use_container_width=True, type="primary" if st.session_state.page == "archiv" else "secondary"): 
-        st.session_state.page = "archiv"; st.rerun()
+    for col, page, label in [(c1, "speichern", "💾 Speichern / Edit"), (c2, "repertoire", "🎵 Repertoire"), (c3, "orte", "📍 Orte"), (c4, "archiv", "📂 Archiv")]:
+        col.button(label, use_container_width=True, type="primary" if st.session_state.page == page else "secondary", on_click=go_to, args=(page,))
     st.markdown("---")
 
+@st.cache_resource
+def get_api():
+    """Prozessweite Drosselung, Retries und Request-Bündelung für alle Google-Calls."""
+    return api.Api()
+
 @st.cache_resource
 def get_gspread_client():
     scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
     s_info = st.secrets["gcp_service_account"]
     creds = Credentials.from_service_account_info(s_info, scopes=scopes)
     client = gspread.authorize(creds)
-    drive_service = build('drive', 'v3', credentials=creds)
+    # Drive-Client erst beim ersten Zugriff bauen (aus dem mitgelieferten Discovery-Dokument)
+    drive_service = api.DriveProxy(drive.LazyService(creds), get_api())
     return client, drive_service
 
-try:
-    client, drive_service = get_gspread_client()
-    sh = client.open(DB_NAME)
-except Exception as e:
-    st.error(f"Verbindungsfehler: {e}"); st.stop()
+@st.cache_resource
+def get_spreadsheet():
+    """Tabelle einmal pro Prozess öffnen; mit 'spreadsheet_id' in den Secrets ohne Drive-Suche."""
+    client, _ = get_gspread_client()
+    key = st.secrets.get("spreadsheet_id")
+    sh = get_api().call("sheets", "sheets.open", lambda: client.open_by_key(key) if key else client.open(DB_NAME))
+    return api.SpreadsheetProxy(sh, get_api())
 
 # --- HELPER FUNKTIONEN ---
 
+@st.cache_resource
+def get_drive_cache():
+    return drive.DriveCache(get_gspread_client()[1])
+
 def get_folder_id(folder_name, parent_id=None):
-    query = f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-    if parent_id: query += f" and '{parent_id}' in parents"
-    try:
-        results = drive_service.files().list(q=query, fields="files(id)").execute()
-        items = results.get('files', [])
-        if items: return items[0]['id']
-    except: pass
-    return None
+    return get_drive_cache().folder_id(folder_name, parent_id)
 
 def list_files_in_templates():
-    root_id = get_folder_id("GEMA Bpol")
-    if not root_id: return [], "Hauptordner 'GEMA Bpol' nicht gefunden."
-    fid = get_folder_id("Templates", parent_id=root_id)
-    if not fid: fid = get_folder_id("Templates")
-    if not fid: return [], "Ordner 'Templates' nicht gefunden."
-    
-    query = f"'{fid}' in parents and trashed = false"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
-    return results.get('files', []), None
+    return get_drive_cache().list_templates()
 
-def download_specific_template(file_id, local_filename):
-    try:
-        content = drive_service.files().get_media(fileId=file_id).execute()
-        with open(local_filename, "wb") as f: f.write(content)
-        return True, None
-    except Exception as e: return False, str(e)
+# --- EXCEL ---
+
+@st.cache_resource
+def get_uploader():
+    return drive.UploadQueue(get_drive_cache())
 
-# --- EXCEL HELPER ---
+def process_and_upload_excel(template_file_id, datum, uhrzeit, ensemble, ort_data, songs_list, target_filename, save_event=None):
+    """``setlist.generate`` mit den gecachten Ressourcen; Rückgabe: (BytesIO, Upload-Job-ID, Fehler)."""
+    return setlist.generate(get_drive_cache(), get_uploader(), get_snapshot(), template_file_id, songs_list, target_filename, save_event)
 
-def safe_write(ws, row, col, value):
-    try:
-        cell = ws.cell(row=row, column=col)
-        if isinstance(cell, MergedCell):
-            for r in ws.merged_cells.ranges:
-                if cell.coordinate in r:
-                    ws.cell(r.min_row, r.min_col).value = value; break
-        else: cell.value = value
-    except: pass
-
-def repair_red_stars(ws):
+def generate_season(template_file_id, df_sel):
     """
-    Malt die Sternchen in den Zeilen 19/20 wieder rot an.
-    Betroffene Zellen laut User: B, D, F, G, K, L in Zeilen 19 & 20
+    Generiert die Setlists aller Events in ``df_sel`` mit einem gecachten Template parallel.
+    Rückgabe: (ZIP als BytesIO, [(Event_ID, Dateiname, Bytes)], Fehler oder None)
     """
-    red_font = Font(color="FF0000", bold=True) # Rot und Fett
-    
-    # Spalten-Indices (B=2, D=4, F=6, G=7, K=11, L=12)
-    target_cols = [2, 4, 6, 7, 11, 12] 
-    target_rows = [19, 20]
-    
-    for r in target_rows:
-        for c in target_cols:
-            try:
-                # Wir holen die Zelle. Wenn Merged, müssen wir den "Chef" finden
-                cell = ws.cell(row=r, column=c)
-                if isinstance(cell, MergedCell):
-                    for rng in ws.merged_cells.ranges:
-                        if cell.coordinate in rng:
-                            cell = ws.cell(rng.min_row, rng.min_col)
-                            break
-                
-                # Wir färben den Text in der Zelle rot
-                # ACHTUNG: Das färbt den GANZEN Text in der Zelle rot.
-                # Wenn da steht "Titel *", wird alles rot. 
-                # Das ist der Kompromiss, da "RichText" (nur das Sternchen rot) sehr komplex ist.
-                if cell.value:
-                    cell.font = red_font
-            except:
-                pass
-
-def process_and_upload_excel(template_file_id, datum, uhrzeit, ensemble, ort_data, songs_list, target_filename):
-    local_temp = "temp_template.xlsx"
-    ok, err = download_specific_template(template_file_id, local_temp)
-    if not ok: return None, None, f"Download Fehler: {err}"
-
-    try:
-        wb = openpyxl.load_workbook(local_temp)
-        ws = wb.active 
-        
-        # Zeilen 1-20 lassen wir in Ruhe (Header Daten werden nicht geschrieben um Layout zu schützen)
-        
-        start_row = 21
-        current_row = start_row
-        
-        # Leeren ab Zeile 21
-        cols = [2, 5, 6, 7, 10, 16, 17]
-        for r in range(start_row, 100):
-            for c in cols: safe_write(ws, r, c, None)
-
-        # Befüllen
-        for song in songs_list:
-            safe_write(ws, current_row, 2, song['Titel']) 
-            safe_write(ws, current_row, 5, song['Dauer']) 
-            safe_write(ws, current_row, 6, song['Komponist_Nachname']) 
-            safe_write(ws, current_row, 7, song['Komponist_Vorname']) 
-            safe_write(ws, current_row, 10, song['Verlag']) 
-            safe_write(ws, current_row, 16, song['Bearbeiter_Nachname']) 
-            safe_write(ws, current_row, 17, song['Bearbeiter_Vorname']) 
-            current_row += 1
-        
-        # --- DIE LACKIEREREI: Sternchen rot machen ---
-        repair_red_stars(ws)
-            
-        wb.save(target_filename)
-        
-        output_bytes = BytesIO()
-        with open(target_filename, "rb") as f: output_bytes.write(f.read())
-        output_bytes.seek(0)
-        
-    except Exception as e:
-        return None, None, f"Excel Fehler: {e}"
-
-    # Upload Versuch (mit 'supportsAllDrives' Hack)
-    web_link = "Lokal (Upload Limit)"
+    dc = get_drive_cache()
+    try: template_bytes = dc.template_bytes(template_file_id)
+    except Exception as e: return None, [], f"Download Fehler: {e}"
+    rep_idx = get_rep_index()
+
+    eids, names, song_lists, seen = [], [], [], set()
+    for r in df_sel.to_dict('records'):
+        fname = r.get('Setlist_Name') or f"{r['Ensemble']}{r['Datum']}{r['Stadt']}Setlist.xlsx"
+        if fname in seen: fname = fname.replace(".xlsx", f"_{r['Event_ID']}.xlsx")
+        seen.add(fname)
+        eids.append(r['Event_ID']); names.append(fname)
+        song_lists.append([s for s in map(rep_idx.row_by_id, clean_id_list_from_string(r['Songs_IDs'])) if s])
+
+    # auch BrokenProcessPool, falls ein Worker-Prozess stirbt
+    try: blobs = excel.render_many(template_bytes, song_lists)
+    except Exception as e: return None, [], f"Excel Fehler: {e}"
+
+    zip_buf = BytesIO()
+    with zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_STORED) as zf:
+        for fname, data in zip(names, blobs): zf.writestr(fname, data)
+    zip_buf.seek(0)
+    return zip_buf, list(zip(eids, names, blobs)), None
+
+def upload_season(files):
+    """Lädt die Dateien aus ``generate_season`` hoch und schreibt alle File_Links in einem Batch; gibt die Fehler zurück."""
+    dc = get_drive_cache()
     try:
         root_id = get_folder_id("GEMA Bpol")
-        if root_id:
-            output_id = get_folder_id("Output", parent_id=root_id)
-            if output_id:
-                file_metadata = {'name': target_filename, 'parents': [output_id]}
-                media = MediaFileUpload(target_filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                
-                # supportsAllDrives=True hilft manchmal bei Quota Problemen
-                file = drive_service.files().create(
-                    body=file_metadata, 
-                    media_body=media, 
-                    fields='id, webViewLink',
-                    supportsAllDrives=True 
-                ).execute()
-                web_link = file.get('webViewLink')
-    except Exception:
-        pass # Fehler ignorieren, Download Button ist da
-
-    if os.path.exists(local_temp): os.remove(local_temp)
-    if os.path.exists(target_filename): os.remove(target_filename)
-
-    return output_bytes, web_link, None
+        output_id = get_folder_id("Output", parent_id=root_id) if root_id else None
+    except Exception as e: return [f"Drive nicht erreichbar, nur ZIP erstellt: {e}"]
+    if not output_id: return ["Ordner 'GEMA Bpol/Output' nicht gefunden, nur ZIP erstellt."]
+
+    def up(item):
+        _, fname, data = item
+        try: return dc.upload(BytesIO(data), fname, output_id, excel.XLSX_MIME), None
+        except Exception as e: return None, f"{fname}: {e}"
+    with ThreadPoolExecutor(max_workers=4) as pool: results = list(pool.map(up, files))
+
+    errors = []
+    snap = get_snapshot()
+    batch = db.Batch(snap)
+    for (eid, fname, _), (link, err) in zip(files, results):
+        if err: errors.append(err)
+        # inzwischen gelöschtes Event: sonst scheitert der ganze Batch an einer Zeile
+        elif snap.row_of("Events", eid) is None: errors.append(f"{fname}: Event {eid} nicht mehr in der Tabelle, File_Link nicht gesetzt")
+        elif link: batch.update("Events", eid, [link], start_col=setlist.FILE_LINK_COL)
+    try: batch.flush()
+    except Exception as e: errors.append(f"File_Links nicht gespeichert: {e}")
+    return errors
 
 # --- DB & CACHE ---
 def check_and_fix_db():
-    if st.session_state.db_checked: return
-    try: 
-        ws = sh.worksheet("Repertoire")
-        if not ws.row_values(1): ws.update('A1:J1', [['ID','Titel','Komponist_Nachname','Komponist_Vorname','Bearbeiter_Nachname','Bearbeiter_Vorname','Dauer','Verlag','Werkeart','ISWC']])
-    except: pass
-    try:
-        ws = sh.worksheet("Events")
-        if not ws.row_values(1): ws.update('A1:K1', [['Event_ID','Datum','Uhrzeit','Ensemble','Location_Name','Strasse','PLZ','Stadt','Setlist_Name','Songs_IDs','File_Link']])
-    except: pass
-    try:
-        ws = sh.worksheet("Locations")
-        if not ws.row_values(1): ws.update('A1:E1', [['ID','Name','Strasse','PLZ','Stadt']])
-    except: pass
-    st.session_state.db_checked = True
-
-@st.cache_data(ttl=600)
-def get_data_repertoire():
-    ws = sh.worksheet("Repertoire"); df = pd.DataFrame(ws.get_all_records())
-    for c in ['ID','Titel','Komponist_Nachname','Bearbeiter_Nachname']: 
-        if c not in df.columns: df[c]=""
-    if not df.empty:
-        df['ID'] = df['ID'].astype(str).str.replace(r'\.0$', '', regex=True)
-        df['Label'] = df.apply(lambda x: f"{x['Titel']} ({x['Komponist_Nachname']})" + (f" / Arr: {x['Bearbeiter_Nachname']}" if x['Bearbeiter_Nachname'] else ""), axis=1)
-    return df
-
-@st.cache_data(ttl=600)
-def get_data_locations():
-    ws = sh.worksheet("Locations"); df = pd.DataFrame(ws.get_all_records())
-    return df if not df.empty else pd.DataFrame(columns=['ID','Name','Strasse','PLZ','Stadt'])
-
-@st.cache_data(ttl=600)
-def get_data_events():
-    ws = sh.worksheet("Events"); df = pd.DataFrame(ws.get_all_records())
-    if not df.empty and 'Datum' in df.columns: df['Datum_Obj'] = pd.to_datetime(df['Datum'], format="%d.%m.%Y", errors='coerce')
-    return df
-
-def clear_all_caches():
-    get_data_repertoire.clear(); get_data_locations.clear(); get_data_events.clear()
+    """
+    Kopfzeilen prüfen und ggf. anlegen. Nutzt die Zeile 1 aus dem Snapshot, kostet also
+    keinen eigenen API-Call und schreibt nur, wenn in der aktuellen Revision etwas fehlt.
+    """
+    snap = get_snapshot(); snap.refresh()
+    missing = snap.missing_headers()
+    if missing: db.write_headers(snap, missing)
+
+@st.cache_resource
+def get_snapshot():
+    path = st.secrets.get("replica_path", REPLICA_PATH)
+    store = replica.SqliteReplica(path, db.SHEETS) if path else None
+    return db.Snapshot(get_spreadsheet(), get_gspread_client()[1], store=store)
+
+def get_data_repertoire(): return get_snapshot().get("Repertoire")
+
+def get_data_locations(): return get_snapshot().get("Locations")
+
+def get_data_events(): return get_snapshot().get("Events")
+
+@st.cache_resource(max_entries=2)
+def _rep_index(version):
+    return search.RepertoireIndex(get_data_repertoire())
+
+def get_rep_index():
+    """Repertoire-Index zur aktuellen Repertoire-Version (wird nur nach Änderungen neu gebaut)."""
+    snap = get_snapshot(); snap.refresh()
+    return _rep_index(snap.version("Repertoire"))
+
+@st.cache_resource(max_entries=2)
+def _archive_index(version):
+    return archive.ArchiveIndex(get_data_events())
+
+def get_archive_index():
+    """Sortierter, nach Monaten gruppierter Events-Stand zur aktuellen Events-Version."""
+    snap = get_snapshot(); snap.refresh()
+    return _archive_index(snap.version("Events"))
+
+@st.cache_resource
+def _usage_stats():
+    return stats.UsageStats()
+
+def get_usage_stats():
+    """GEMA-Statistik zum aktuellen Events-Stand; einzelne gespeicherte Events werden nur nachgebucht."""
+    return _usage_stats().sync(get_snapshot())
 
 def clean_id_list_from_string(raw):
     if not raw: return []
     return [s.strip().replace('.0','') for s in str(raw).split(',') if s.strip()]
 
 def save_song_direct(mode, song_id, t, kn, kv, bn, bv, d, v):
-    ws = sh.worksheet("Repertoire")
+    batch = db.Batch(get_snapshot())
     if mode == "Neu":
-        ids = [int(x) for x in ws.col_values(1)[1:] if str(x).isdigit()]
-        new_id = max(ids)+1 if ids else 1
-        ws.append_row([new_id, t, kn, kv, bn, bv, d, v, "U-Musik", ""])
+        batch.insert("Repertoire", [t, kn, kv, bn, bv, d, v, "U-Musik", ""])
         msg = f"'{t}' angelegt!"
     else:
-        try:
-            cell = ws.find(str(song_id), in_column=1)
-            ws.update(f"B{cell.row}:H{cell.row}", [[t, kn, kv, bn, bv, d, v]])
-            msg = f"'{t}' aktualisiert!"
-        except: return False, "Fehler"
-    clear_all_caches(); return True, msg
+        batch.update("Repertoire", song_id, [t, kn, kv, bn, bv, d, v], start_col=2)
+        msg = f"'{t}' aktualisiert!"
+    try: batch.flush()
+    except Exception as e: return False, f"Fehler: {e}"
+    return True, msg
 
 def save_location_direct(n, s, p, c):
-    ws = sh.worksheet("Locations")
-    ids = [int(x) for x in ws.col_values(1)[1:] if str(x).isdigit()]
-    new_id = max(ids)+1 if ids else 1
-    ws.append_row([new_id, n, s, p, c])
-    clear_all_caches(); return True
+    batch = db.Batch(get_snapshot())
+    batch.insert("Locations", [n, s, p, c])
+    batch.flush(); return True
 
 def update_event_in_db(eid, data):
-    ws = sh.worksheet("Events")
-    try:
-        cell = ws.find(str(eid), in_column=1)
-        ws.update(f"A{cell.row}:K{cell.row}", [[eid]+data])
-        clear_all_caches(); return True
-    except: return False
+    batch = db.Batch(get_snapshot())
+    batch.update("Events", eid, [eid]+data)
+    try: batch.flush()
+    except Exception as e:
+        log.error("Event %s nicht aktualisiert: %s", eid, e); return False
+    return True
+
+def append_event_to_db(data):
+    return setlist.append_event(get_snapshot(), data)
 
 # --- UI (MAIN) ---
 
-check_and_fix_db()
-st.title("Orchester Manager 🎻")
-navigation_bar()
+UPLOAD_ACTIVE = ("pending", "running")
 
-if st.session_state.page == "speichern":
-    df_loc = get_data_locations(); df_rep = get_data_repertoire(); df_events = get_data_events()
-    
-    if st.session_state.last_download:
-        d_name, d_bytes = st.session_state.last_download
-        cloud_stat = st.session_state.uploaded_file_link
-        st.success("✅ Datei bereit!")
-        c1, c2 = st.columns(2)
-        c1.download_button(f"📥 {d_name}", d_bytes, d_name, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", type="primary", use_container_width=True)
-        if "http" in str(cloud_stat): c2.link_button("☁️ Drive Link", cloud_stat, use_container_width=True)
-        else: c2.info("⚠️ Cloud-Upload technisch nicht möglich (Google Quota). Bitte lokal speichern.")
-        st.divider()
+def cloud_status(job_id):
+    """Upload-Status; gepollt wird nur, solange der Job noch läuft."""
+    job = get_uploader().status(job_id)
+    if job["state"] in UPLOAD_ACTIVE: cloud_status_poll(job_id)
+    elif "http" in str(job["link"]): st.link_button("☁️ Drive Link", job["link"], use_container_width=True)
+    else: st.info(f"⚠️ Cloud-Upload nicht möglich ({job['error'] or 'unbekannt'}). Bitte lokal speichern.")
 
-    if not st.session_state.gig_draft["event_id"]:
-        with st.expander("🛠 Bearbeiten"):
-            if not df_events.empty:
-                opts = df_events.sort_values('Datum_Obj', ascending=False)['Label'].tolist() if 'Label' in df_events else []
-                sel = st.selectbox("Wahl:", ["-"]+opts)
-                if st.button("Laden") and sel != "-":
-                    row = df_events[df_events['Label']==sel].iloc[0]
-                    st.session_state.gig_draft.update({"event_id": row['Event_ID'], "datum": datetime.datetime.strptime(row['Datum'], "%d.%m.%Y").date(), "ensemble": row['Ensemble'], "location_selection": row['Location_Name']})
-                    ids = clean_id_list_from_string(row['Songs_IDs'])
-                    st.session_state.gig_song_selector = df_rep[df_rep['ID'].isin(ids)]['Label'].tolist() if not df_rep.empty else []
-                    st.session_state.last_download = None; st.rerun()
+@st.fragment(run_every=2)
+def cloud_status_poll(job_id):
+    """Pollt nur den Upload-Status (In-Memory), ohne die ganze Seite neu zu laden."""
+    # run_every lässt sich nicht abschalten: ein Seiten-Rerun zeigt das Ergebnis ohne dieses Fragment
+    if get_uploader().status(job_id)["state"] not in UPLOAD_ACTIVE: st.rerun()
+    st.info("☁️ Upload läuft...")
 
-    if st.session_state.gig_draft["event_id"]:
-        if st.button("⬅️ Zurück"): 
-            st.session_state.trigger_reset = True; st.rerun()
-        st.header(f"✏️ Edit ID: {st.session_state.gig_draft['event_id']}")
-    else: st.header("📝 Neu")
+# --- SPEICHERN: FRAGMENTE ---
+# Jeder Abschnitt läuft bei einer Interaktion allein neu (ohne DB-Check, Loader und Rest der Seite);
+# Daten kommen aus dem gemeinsamen Snapshot-Cache, der Entwurf aus session_state.
 
-    c1, c2 = st.columns(2)
-    st.session_state.gig_draft["datum"] = c1.date_input("Datum", st.session_state.gig_draft["datum"])
-    st.session_state.gig_draft["uhrzeit"] = c2.time_input("Zeit", st.session_state.gig_draft["uhrzeit"])
-    ens = st.selectbox("Ensemble", ["Tutti", "BQ", "Quartett", "Duo"], index=["Tutti", "BQ", "Quartett", "Duo"].index(st.session_state.gig_draft["ensemble"]))
-    st.session_state.gig_draft["ensemble"] = ens
+ENSEMBLES = ["Tutti", "BQ", "Quartett", "Duo"]
+
+def timed_fragment(fn):
+    """``st.fragment``, dessen Laufzeit als ``fragment.<name>`` auf der Performance-Seite landet.
 
+    Läuft nur das Fragment neu, gibt es keinen Seiten-Rerun drumherum: dann bekommt das
+    Fragment einen eigenen ``metrics.Run`` samt JSON-Logzeile und API-Zählern.
+    """
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        ctx = get_script_run_ctx()
+        own = metrics.begin_run(page=st.session_state.page, fragment=fn.__name__) if ctx and ctx.fragment_ids_this_run else None
+        try:
+            with metrics.span(f"fragment.{fn.__name__}"): return fn(*args, **kwargs)
+        finally:
+            if own is not None: metrics.end_run(own)
+    return st.fragment(run)
+
+def load_event_for_edit():
+    """Callback für 'Laden': übernimmt das gewählte Event in den Entwurf, bevor die Seite neu läuft."""
+    sel = st.session_state.get("gig_edit_pick", "-")
+    df_events = get_data_events()
+    if sel == "-" or 'Label' not in df_events: return
+    row = df_events[df_events['Label']==sel].iloc[0]
+    st.session_state.gig_draft.update({"event_id": row['Event_ID'], "datum": datetime.datetime.strptime(row['Datum'], "%d.%m.%Y").date(), "ensemble": row['Ensemble'], "location_selection": row['Location_Name']})
+    ids = clean_id_list_from_string(row['Songs_IDs'])
+    st.session_state.gig_song_selector = get_rep_index().labels_for_ids(ids)
+    st.session_state.last_download = None
+
+def selected_location():
+    sel = st.session_state.gig_draft["location_selection"]
+    df_loc = get_data_locations()
+    hit = df_loc[df_loc['Name']==sel] if 'Name' in df_loc else df_loc.iloc[0:0]
+    return hit.iloc[0].to_dict() if not hit.empty else {}
+
+@timed_fragment
+def event_details():
+    draft = st.session_state.gig_draft
+    c1, c2 = st.columns(2)
+    draft["datum"] = c1.date_input("Datum", draft["datum"])
+    draft["uhrzeit"] = c2.time_input("Zeit", draft["uhrzeit"])
+    draft["ensemble"] = st.selectbox("Ensemble", ENSEMBLES, index=ENSEMBLES.index(draft["ensemble"]))
+
+def save_new_location():
+    """Callback des Orts-Formulars: speichert und wählt den neuen Ort, bevor das Fragment neu läuft."""
+    n, s, p, c = (st.session_state.get(f"new_loc_{k}", "") for k in "nspc")
+    if not (n and c): st.session_state.new_loc_error = True; return
+    save_location_direct(n,s,p,c)
+    st.session_state.gig_draft["location_selection"] = n
+    st.session_state.new_loc_saved = True
+
+@timed_fragment
+def location_picker():
+    draft = st.session_state.gig_draft
     st.write("📍 Ort")
-    locs = ["Wählen..."] + df_loc['Name'].tolist() + ["➕ Neu..."]
-    try: idx = locs.index(st.session_state.gig_draft["location_selection"])
+    locs = ["Wählen..."] + get_data_locations()['Name'].tolist() + ["➕ Neu..."]
+    try: idx = locs.index(draft["location_selection"])
     except: idx = 0
     sel_loc = st.selectbox("Ort", locs, index=idx)
-    st.session_state.gig_draft["location_selection"] = sel_loc
+    draft["location_selection"] = sel_loc
+    # Ausgaben aus dem Callback selbst wären in einem Fragment-Rerun nicht sauber platziert
+    if st.session_state.pop("new_loc_saved", False): st.toast("Gespeichert!", icon="✅")
 
-    fin_loc = {}
     if sel_loc == "➕ Neu...":
         with st.form("new_loc"):
-            n=st.text_input("Name"); s=st.text_input("Str"); p=st.text_input("PLZ"); c=st.text_input("Stadt")
-            if st.form_submit_button("Speichern"):
-                if n and c:
-                    save_location_direct(n,s,p,c)
-                    st.session_state.gig_draft["location_selection"] = n
-                    st.toast("Gespeichert!", icon="✅"); time.sleep(1); st.rerun()
-                else: st.error("Name/Stadt fehlt")
-    elif sel_loc != "Wählen...":
-        fin_loc = df_loc[df_loc['Name']==sel_loc].iloc[0].to_dict()
+            for key, label in [("n", "Name"), ("s", "Str"), ("p", "PLZ"), ("c", "Stadt")]: st.text_input(label, key=f"new_loc_{key}")
+            st.form_submit_button("Speichern", on_click=save_new_location)
+        if st.session_state.pop("new_loc_error", False): st.error("Name/Stadt fehlt")
 
-    st.markdown("---")
+@timed_fragment
+def song_selector():
     st.write("🎵 Programm")
     with st.expander("➕ Schnell-Anlage"):
         with st.form("quick"):
@@ -363,53 +361,108 @@ if st.session_state.page == "speichern":
             c5,c6=st.columns(2); bn=c5.text_input("Bearb NN"); bv=c6.text_input("Bearb VN")
             ver=st.text_input("Verlag")
             if st.form_submit_button("Speichern"):
-                if t and kn: save_song_direct("Neu",None,t,kn,kv,bn,bv,d,ver); st.rerun()
-
-    if not df_rep.empty:
-        sel_songs = st.multiselect("Suche", df_rep['Label'].tolist(), key="gig_song_selector")
-        st.markdown("---")
-        
-        files, err = list_files_in_templates()
-        if not files: st.error(err if err else "Keine Templates gefunden")
-        else:
-            t_names = [f['name'] for f in files]
-            t_sel = st.selectbox("Vorlage", t_names)
-            t_id = next(f['id'] for f in files if f['name'] == t_sel)
-
-            if st.button("✅ Fertigstellen", type="primary", use_container_width=True):
-                if not fin_loc.get("Name") or not sel_songs:
-                    st.error("Ort oder Songs fehlen")
-                else:
-                    d_str = st.session_state.gig_draft["datum"].strftime("%d.%m.%Y")
-                    t_str = st.session_state.gig_draft["uhrzeit"].strftime("%H:%M")
-                    fname = f"{ens}{d_str}{fin_loc['Stadt']}Setlist.xlsx"
-                    
-                    s_data = []
-                    s_ids = []
-                    for lbl in sel_songs:
-                        r = df_rep[df_rep['Label']==lbl].iloc[0]
-                        s_ids.append(str(r['ID']))
-                        s_data.append(r.to_dict())
+                if t and kn:
+                    # Suche und Auswahl werden erst danach gebaut und sehen den neuen Titel schon
+                    ok, msg = save_song_direct("Neu",None,t,kn,kv,bn,bv,d,ver)
+                    if ok: st.toast(msg, icon="✅")
+                    else: st.error(msg)
+
+    if get_data_repertoire().empty: st.warning("Repertoire leer."); return
+    rep_idx = get_rep_index()
+    q = st.text_input("🔎 Suche (Titel, Komponist, Bearbeiter)", key="gig_song_query")
+    # Nur Treffer + bereits gewählte Songs an den Browser schicken, nicht den ganzen Katalog
+    opts = list(dict.fromkeys(st.session_state.gig_song_selector + rep_idx.search(q, limit=100)))
+    st.multiselect("Programm", opts, key="gig_song_selector")
+
+@timed_fragment
+def template_picker():
+    files, err = list_files_in_templates()
+    if not files:
+        st.error(err if err else "Keine Templates gefunden")
+        # auch "nicht gefunden" bleibt im DriveCache bis zum TTL; neu angelegte Ordner/Vorlagen sofort holen
+        st.button("🔄 Vorlagen neu laden", on_click=get_drive_cache().invalidate); return
+    st.selectbox("Vorlage", [f['name'] for f in files], key="gig_template")
+
+@timed_fragment
+def generate_action():
+    if not st.button("✅ Fertigstellen", type="primary", use_container_width=True): return
+    files, _ = list_files_in_templates()
+    t_id = next((f['id'] for f in files if f['name'] == st.session_state.get("gig_template")), None)
+    draft = st.session_state.gig_draft
+    fin_loc = selected_location()
+    sel_songs = st.session_state.gig_song_selector
+    if not t_id: st.error("Keine Vorlage gewählt"); return
+    if not fin_loc.get("Name") or not sel_songs: st.error("Ort oder Songs fehlen"); return
+
+    ens = draft["ensemble"]
+    d_str = draft["datum"].strftime("%d.%m.%Y")
+    t_str = draft["uhrzeit"].strftime("%H:%M")
+    fname = f"{ens}{d_str}{fin_loc['Stadt']}Setlist.xlsx"
+
+    rep_idx = get_rep_index()
+    s_data = [r for r in map(rep_idx.row, sel_songs) if r]
+    s_ids = [str(r['ID']) for r in s_data]
+
+    row = [d_str, t_str, ens, fin_loc["Name"], fin_loc["Strasse"], str(fin_loc["PLZ"]), fin_loc["Stadt"], fname, ",".join(s_ids)]
+    eid = draft["event_id"]
+    def save_event(link):
+        if eid: return eid if update_event_in_db(eid, row+[link]) else None
+        return append_event_to_db(row+[link])
+
+    with st.spinner("Generiere..."):
+        b, job, err = process_and_upload_excel(t_id, d_str, t_str, ens, fin_loc, s_data, fname, save_event)
+    if b is None: st.error(err); return
+    st.session_state.last_download = (fname, b.getvalue())
+    st.session_state.upload_job = job
+    st.session_state.save_error = err
+    # Entwurf nur nach erfolgreichem Speichern leeren, sonst lässt er sich direkt erneut speichern
+    st.session_state.trigger_reset = err is None
+    # Download-Bereich oben und leerer Entwurf: hier ist ein Rerun der ganzen Seite gewollt
+    st.rerun()
 
-                    with st.spinner("Generiere..."):
-                        b, link, err = process_and_upload_excel(t_id, d_str, t_str, ens, fin_loc, s_data, fname)
-                        if err: st.error(err)
-                        else:
-                            row = [d_str, t_str, ens, fin_loc["Name"], fin_loc["Strasse"], str(fin_loc["PLZ"]), fin_loc["Stadt"], fname, ",".join(s_ids), str(link)]
-                            eid = st.session_state.gig_draft["event_id"]
-                            if eid: update_event_in_db(eid, row)
-                            else:
-                                ws = sh.worksheet("Events")
-                                ids = [int(x) for x in ws.col_values(1)[1:] if str(x).isdigit()]
-                                new_eid = max(ids)+1 if ids else 1
-                                ws.append_row([new_eid]+row)
-                                clear_all_caches()
-                            
-                            st.session_state.last_download = (fname, b.getvalue())
-                            st.session_state.uploaded_file_link = link
-                            st.session_state.trigger_reset = True
-                            st.rerun()
-    else: st.warning("Repertoire leer.")
+st.title("Orchester Manager 🎻")
+navigation_bar()
+
+if 'first_paint_ms' not in st.session_state:
+    st.session_state.first_paint_ms = round((time.perf_counter() - T_START) * 1000)
+    metrics.record("first_paint", st.session_state.first_paint_ms)
+    log.info("first paint after %d ms", st.session_state.first_paint_ms)
+
+try: check_and_fix_db()
+except Exception as e:
+    st.error(f"Verbindungsfehler: {e}"); st.stop()
+
+if st.session_state.page == "speichern":
+    if st.session_state.last_download:
+        d_name, d_bytes = st.session_state.last_download
+        if st.session_state.save_error: st.error(f"⚠️ Datei bereit, aber nicht in der Datenbank: {st.session_state.save_error} Bitte erneut speichern.")
+        else: st.success("✅ Datei bereit!")
+        c1, c2 = st.columns(2)
+        c1.download_button(f"📥 {d_name}", d_bytes, d_name, excel.XLSX_MIME, type="primary", use_container_width=True)
+        if st.session_state.upload_job:
+            with c2: cloud_status(st.session_state.upload_job)
+        st.divider()
+
+    if not st.session_state.gig_draft["event_id"]:
+        with st.expander("🛠 Bearbeiten"):
+            df_events = get_data_events()
+            if not df_events.empty:
+                opts = df_events.sort_values('Datum_Obj', ascending=False)['Label'].tolist() if 'Label' in df_events else []
+                st.selectbox("Wahl:", ["-"]+opts, key="gig_edit_pick")
+                st.button("Laden", on_click=load_event_for_edit)
+
+    if st.session_state.gig_draft["event_id"]:
+        st.button("⬅️ Zurück", on_click=reset_draft_logic, kwargs={"keep_download": True})
+        st.header(f"✏️ Edit ID: {st.session_state.gig_draft['event_id']}")
+    else: st.header("📝 Neu")
+
+    event_details()
+    location_picker()
+    st.markdown("---")
+    song_selector()
+    st.markdown("---")
+    template_picker()
+    generate_action()
 
 # --- ANDERE SEITEN ---
 elif st.session_state.page == "repertoire":
@@ -417,9 +470,11 @@ elif st.session_state.page == "repertoire":
     mode = st.radio("Modus", ["Neu", "Edit"], horizontal=True)
     df = get_data_repertoire()
     if mode=="Edit" and not df.empty:
-        sel = st.selectbox("Wahl", df['Label'].tolist(), index=None)
+        rep_idx = get_rep_index()
+        q = st.text_input("🔎 Suche", key="rep_query")
+        sel = st.selectbox("Wahl", rep_idx.search(q, limit=100), index=None)
         if sel:
-            r = df[df['Label']==sel].iloc[0]
+            r = rep_idx.row(sel)
             if st.session_state.rep_edit_state["id"] != r['ID']:
                 st.session_state.rep_edit_state = {"id": r['ID'], "titel": r['Titel'], "dauer": str(r['Dauer']), "kn": r['Komponist_Nachname'], "kv": r['Komponist_Vorname'], "bn": r['Bearbeiter_Nachname'], "bv": r['Bearbeiter_Vorname'], "verlag": r['Verlag']}
     elif mode=="Neu": st.session_state.rep_edit_state = {"id": None, "titel": "", "dauer": "03:00", "kn": "", "kv": "", "bn": "", "bv": "", "verlag": ""}
@@ -431,29 +486,101 @@ elif st.session_state.page == "repertoire":
         c5,c6=st.columns(2); bn=c5.text_input("Bearb NN", s['bn']); bv=c6.text_input("Bearb VN", s['bv'])
         v=st.text_input("Verlag", s['verlag'])
         if st.form_submit_button("Speichern"):
-            save_song_direct("Edit" if s['id'] else "Neu", s['id'], t, kn, kv, bn, bv, d, v); st.rerun()
+            ok, msg = save_song_direct("Edit" if s['id'] else "Neu", s['id'], t, kn, kv, bn, bv, d, v)
+            if ok: st.rerun()
+            else: st.error(msg)
     st.dataframe(df)
 
 elif st.session_state.page == "orte":
     st.subheader("Orte")
     with st.form("l"):
         n=st.text_input("Name"); c=st.text_input("Stadt")
-        if st.form_submit_button("Speichern"): save_location_direct(n,"","",c); st.rerun()
+        if st.form_submit_button("Speichern"): save_location_direct(n,"","",c)
     st.dataframe(get_data_locations())
 
 elif st.session_state.page == "archiv":
     st.subheader("Archiv")
-    df = get_data_events()
-    if not df.empty:
-        df = df.sort_values('Datum_Obj', ascending=False)
-        for y in df['Datum_Obj'].dt.year.unique():
-            st.markdown(f"### {y}")
-            dfy = df[df['Datum_Obj'].dt.year==y]
-            for m in dfy['Datum_Obj'].dt.month.unique():
-                mn = datetime.date(2000,int(m),1).strftime('%B')
-                with st.expander(f"{mn} ({len(dfy[dfy['Datum_Obj'].dt.month==m])})"):
-                    for _,r in dfy[dfy['Datum_Obj'].dt.month==m].iterrows():
-                        st.write(f"**{r['Datum']}** | {r['Location_Name']}"); st.caption(r['Setlist_Name'])
-                        if "http" in str(r.get('File_Link','')): st.link_button("☁️ Drive", r['File_Link'])
-                        else: st.caption("Lokal")
-                        st.divider()
+    arch = get_archive_index()
+    if len(arch):
+        with st.expander("📦 Saison-Export"):
+            c1, c2 = st.columns(2)
+            von = c1.date_input("Von", datetime.date(datetime.date.today().year, 1, 1))
+            bis = c2.date_input("Bis", datetime.date.today())
+            df_sel = arch.frame(arch.select(von, bis))
+            labels = (df_sel['Datum'].astype(str) + " | " + df_sel['Location_Name'].astype(str) + " | " + df_sel['Setlist_Name'].astype(str)).tolist()
+            picked = st.multiselect("Auswahl (leer = alle im Zeitraum)", labels)
+            if picked: df_sel = df_sel[[l in picked for l in labels]]
+            files, err = list_files_in_templates()
+            if not files: st.error(err if err else "Keine Templates gefunden")
+            else:
+                t_sel = st.selectbox("Vorlage", [f['name'] for f in files], key="season_template")
+                t_id = next(f['id'] for f in files if f['name'] == t_sel)
+                upload = st.checkbox("Nach Drive hochladen und File_Link setzen", value=True)
+                if st.button(f"📦 {len(df_sel)} Setlists generieren", disabled=df_sel.empty):
+                    with st.spinner("Generiere..."):
+                        zip_buf, files, err = generate_season(t_id, df_sel)
+                    if err: st.error(err)
+                    else:
+                        # ZIP vor dem Upload sichern: scheitert Drive oder der File_Link-Batch, bleibt der Download
+                        st.session_state.season_zip = (f"Setlists_{von:%Y%m%d}-{bis:%Y%m%d}.zip", zip_buf.getvalue())
+                        if upload:
+                            with st.spinner("Lade hoch..."): errors = upload_season(files)
+                            if errors: st.error("Upload bzw. File_Links unvollständig, das ZIP steht trotzdem komplett zum Download bereit:")
+                            for e in errors: st.warning(e)
+                if st.session_state.get("season_zip"):
+                    z_name, z_bytes = st.session_state.season_zip
+                    st.download_button(f"📥 {z_name}", z_bytes, z_name, "application/zip", type="primary", use_container_width=True)
+
+        with st.expander("📊 GEMA-Statistik"):
+            usage = get_usage_stats()
+            c1, c2 = st.columns(2)
+            by = c1.multiselect("Gruppieren nach", stats.DIMENSIONS, default=["Jahr"], key="stats_by")
+            years = c2.multiselect("Jahre (leer = alle)", usage.years(), key="stats_years")
+            report = usage.report(get_data_repertoire(), by, years)
+            st.caption(f"{len(report)} Zeilen · {report['Aufführungen'].sum()} Aufführungen")
+            st.dataframe(report, hide_index=True, use_container_width=True)
+            c1, c2 = st.columns(2)
+            c1.download_button("📥 Excel", stats.to_xlsx(report), "GEMA_Statistik.xlsx", excel.XLSX_MIME, use_container_width=True)
+            c2.download_button("📥 CSV", stats.to_csv(report), "GEMA_Statistik.csv", "text/csv", use_container_width=True)
+
+        with st.expander("🗄️ Komplett-Export"):
+            st.caption("Alle Events mit aufgelösten Setlists, z.B. für Verband oder Buchhaltung. Die Datei wird erst beim Klick erzeugt.")
+            fmt = st.radio("Format", ["Excel (Events + Setlists)", "CSV (eine Zeile pro Titel)"], horizontal=True, key="export_fmt")
+            write, ext, mime = (export.write_xlsx, "xlsx", excel.XLSX_MIME) if fmt.startswith("Excel") else (export.write_csv, "csv", "text/csv")
+            st.download_button("📥 Archiv exportieren", functools.partial(export.to_file, write, get_data_events(), get_rep_index()),
+                               f"GEMA_Archiv_{datetime.date.today():%Y%m%d}.{ext}", mime, on_click="ignore", use_container_width=True)
+
+        c1, c2, c3 = st.columns(3)
+        f_von = c1.date_input("Ab", value=None, key="arch_von")
+        f_bis = c2.date_input("Bis", value=None, key="arch_bis")
+        f_loc = c3.selectbox("Ort", ["Alle"] + arch.locations, key="arch_loc")
+        groups = arch.months(arch.select(f_von, f_bis, None if f_loc == "Alle" else f_loc))
+        pages = archive.page_count(groups)
+        page = st.selectbox("Seite", range(1, pages+1), key="arch_page") if pages > 1 else 1
+        last_y = None
+        for y, m, pos in archive.page(groups, page):
+            if y != last_y: st.markdown(f"### {y}"); last_y = y
+            mn = datetime.date(2000,m,1).strftime('%B')
+            # Nur aufgeklappte Monate bauen ihre Einträge
+            if st.toggle(f"{mn} ({len(pos)})", key=f"arch_{y}_{m}"):
+                for i in pos: st.markdown(arch.line(i))
+                st.divider()
+    else: st.info("Noch keine Events.")
+
+elif st.session_state.page == "perf":
+    st.subheader("⏱ Performance")
+    runs = pd.DataFrame(metrics.recent_runs())
+    if not runs.empty:
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Reruns", len(runs))
+        c2.metric("API-Calls/Rerun Ø", round(runs['api_calls'].mean(), 2))
+        c3.metric("API-Calls/Rerun p95", round(runs['api_calls'].quantile(0.95), 1))
+    st.write("Latenz pro Stufe")
+    st.dataframe(pd.DataFrame(metrics.summary()), hide_index=True, use_container_width=True)
+    st.write("Zähler (API-Calls, Cache-Hits/-Misses)")
+    st.dataframe(pd.DataFrame(metrics.counters().items(), columns=["Zähler", "Wert"]), hide_index=True, use_container_width=True)
+    if not runs.empty:
+        st.write("Letzte Reruns")
+        st.dataframe(runs[[c for c in ['page', 'fragment', 'ms', 'api_calls'] if c in runs]].iloc[::-1].head(50), hide_index=True, use_container_width=True)
+
+metrics.end_run(st.session_state.metrics_run)
@@ -0,0 +1,62 @@
+"""Archiv-Index: Events einmal pro Snapshot nach Datum sortiert und nach Jahr/Monat gruppiert.
+
+Weil die Events absteigend nach ``Datum_Obj`` sortiert sind, ist jeder Zeitraum und jeder
+Monat ein zusammenhängender Block; Filter sind damit ``searchsorted`` statt Boolean-Masken.
+"""
+import numpy as np
+import pandas as pd
+
+MONTHS_PER_PAGE = 12
+
+def page_count(groups, per_page=MONTHS_PER_PAGE):
+    return max(1, -(-len(groups) // per_page))
+
+def page(groups, n, per_page=MONTHS_PER_PAGE):
+    """Monatsgruppen der Seite ``n`` (1-basiert)."""
+    return groups[(n-1)*per_page:n*per_page]
+
+
+class ArchiveIndex:
+
+    def __init__(self, df_events):
+        if df_events.empty or 'Datum_Obj' not in df_events.columns:
+            df = pd.DataFrame(columns=list(df_events.columns) + ['Datum_Obj'])
+        else:
+            df = df_events[df_events['Datum_Obj'].notna()]
+        self.df = df.sort_values('Datum_Obj', ascending=False, kind='stable').reset_index(drop=True)
+        dates = pd.to_datetime(self.df['Datum_Obj'])
+        self._asc = dates.to_numpy()[::-1]
+        self.ym = (dates.dt.year * 100 + dates.dt.month).to_numpy(dtype=int)
+        self.loc = self.df['Location_Name'].astype(str).to_numpy() if 'Location_Name' in self.df else np.array([""] * len(self.df))
+        self.locations = sorted(set(self.loc) - {""})
+        self.records = self.df.to_dict('records')
+
+    def __len__(self):
+        return len(self.df)
+
+    def select(self, von=None, bis=None, location=None):
+        """Positionen (neueste zuerst) im Zeitraum [von, bis] und optional an einem Ort."""
+        n = len(self.df); lo, hi = 0, n
+        if bis: lo = n - int(np.searchsorted(self._asc, np.datetime64(pd.Timestamp(bis)), side='right'))
+        if von: hi = n - int(np.searchsorted(self._asc, np.datetime64(pd.Timestamp(von)), side='left'))
+        pos = np.arange(lo, max(lo, hi))
+        if location: pos = pos[self.loc[pos] == location]
+        return pos
+
+    def frame(self, pos):
+        return self.df.iloc[pos]
+
+    def line(self, i):
+        """Markdown-Eintrag des Events an Position ``i``."""
+        r = self.records[i]
+        link = str(r.get('File_Link',''))
+        cloud = f"[☁️ Drive]({link})" if "http" in link else "Lokal"
+        return f"**{r['Datum']}** | {r['Location_Name']}  \n{r['Setlist_Name']} · {cloud}"
+
+    def months(self, pos):
+        """[(jahr, monat, positionen), ...] in absteigender Reihenfolge."""
+        if len(pos) == 0: return []
+        keys = self.ym[pos]
+        cuts = np.flatnonzero(np.diff(keys)) + 1
+        return [(int(keys[block[0]]) // 100, int(keys[block[0]]) % 100, pos[block])
+                for block in np.split(np.arange(len(pos)), cuts)]
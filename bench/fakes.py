@@ -0,0 +1,251 @@
+"""In-Memory-Ersatz für Google Sheets und Drive, für Benchmarks ohne Netz.
+
+``FakeSpreadsheet`` bildet die Teile von ``gspread.Spreadsheet`` nach, die ``db`` benutzt
+(``values_batch_get``, ``values_batch_update``, ``values_append``). ``FakeDrive`` bildet
+``files().list/get/get_media/create(...).execute()`` nach. Beide zählen ihre Calls und
+können Latenz sowie Quota-Fehler (HTTP 429) simulieren.
+"""
+import datetime
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import Counter
+from io import BytesIO
+from types import SimpleNamespace
+
+import openpyxl
+from gspread.utils import a1_to_rowcol
+
+import db
+
+SPREADSHEET_ID = "fake-spreadsheet"
+
+
+class QuotaError(Exception):
+    """Sieht für ``api.classify`` aus wie ein 429 von Google."""
+
+    def __init__(self, op):
+        super().__init__(f"429 rateLimitExceeded ({op})")
+        self.response = SimpleNamespace(status_code=429)
+
+
+class Backend:
+    """Gemeinsame Call-Zählung, Latenz und Fehlerquote für Sheets und Drive."""
+
+    def __init__(self, latency=0.0, quota_rate=0.0, seed=0):
+        self.latency = latency
+        self.quota_rate = quota_rate
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def hit(self, op):
+        with self._lock:
+            self.calls[op] += 1
+            fail = self._random.random() < self.quota_rate
+        if self.latency: time.sleep(self.latency)
+        if fail: raise QuotaError(op)
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls.clear()
+
+
+# --- SHEETS ---
+
+class FakeSpreadsheet:
+
+    def __init__(self, backend, drive, data):
+        self.id = SPREADSHEET_ID
+        self.backend = backend
+        self.drive = drive
+        self.data = {name: [list(r) for r in rows] for name, rows in data.items()}
+        self._lock = threading.Lock()
+
+    def values_batch_get(self, ranges, params=None):
+        self.backend.hit("sheets.values_batch_get")
+        with self._lock:
+            return {"valueRanges": [{"range": r, "values": [list(row) for row in self.data.get(r, [])]} for r in ranges]}
+
+    def values_batch_update(self, body=None):
+        self.backend.hit("sheets.values_batch_update")
+        with self._lock:
+            for d in body["data"]:
+                name, rng = d["range"].split("!")
+                row, col = a1_to_rowcol(rng.split(":")[0])
+                for i, cells in enumerate(d["values"]):
+                    self._write(name, row + i, col, cells)
+        self.drive.touch(self.id)
+        return {"totalUpdatedRows": len(body["data"])}
+
+    def values_append(self, range, params=None, body=None):
+        self.backend.hit("sheets.values_append")
+        name = range.split("!")[0]
+        with self._lock:
+            vals = self.data.setdefault(name, [])
+            start = len(vals) + 1
+            for cells in body["values"]: vals.append(_trim([_cell(c) for c in cells]))
+        self.drive.touch(self.id)
+        end = start + len(body["values"]) - 1
+        return {"updates": {"updatedRange": f"{name}!A{start}:K{end}"}}
+
+    def _write(self, name, row, col, cells):
+        vals = self.data.setdefault(name, [])
+        while len(vals) < row: vals.append([])
+        target = vals[row - 1]
+        target += [""] * (col - 1 + len(cells) - len(target))
+        target[col - 1:col - 1 + len(cells)] = [_cell(c) for c in cells]
+        vals[row - 1] = _trim(target)
+
+def _cell(v):
+    return "" if v is None else str(v)
+
+def _trim(row):
+    while row and row[-1] == "": row.pop()
+    return row
+
+
+# --- DRIVE ---
+
+class _Req:
+
+    def __init__(self, backend, op, fn):
+        self.backend = backend
+        self.op = op
+        self.fn = fn
+
+    def execute(self, http=None):
+        self.backend.hit(self.op)
+        return self.fn()
+
+
+class _Files:
+
+    def __init__(self, drive):
+        self.d = drive
+
+    def list(self, q="", fields=None, **kw):
+        return _Req(self.d.backend, "drive.files.list", lambda: {"files": self.d.query(q)})
+
+    def get(self, fileId, fields=None, **kw):
+        return _Req(self.d.backend, "drive.files.get", lambda: dict(self.d.meta(fileId)))
+
+    def get_media(self, fileId, **kw):
+        return _Req(self.d.backend, "drive.files.get_media", lambda: self.d.store[fileId]["content"])
+
+    def create(self, body=None, media_body=None, fields=None, **kw):
+        content = media_body.getbytes(0, media_body.size()) if media_body is not None else b""
+        parent = body.get("parents", [None])[0]
+        return _Req(self.d.backend, "drive.files.create", lambda: self.d.add(body["name"], parent, content=content, props=body.get("appProperties")))
+
+
+class FakeDrive:
+    """Ordner 'GEMA Bpol' mit 'Templates' und 'Output' sowie die Tabelle als versionierte Datei."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.store = {}
+        self._lock = threading.Lock()
+        self._n = 0
+        root = self.add("GEMA Bpol", None, folder=True)["id"]
+        self.templates_id = self.add("Templates", root, folder=True)["id"]
+        self.output_id = self.add("Output", root, folder=True)["id"]
+        self.store[SPREADSHEET_ID] = {"id": SPREADSHEET_ID, "name": "GEMA_Datenbank", "version": "1", "parents": [], "mimeType": "application/vnd.google-apps.spreadsheet"}
+
+    def files(self):
+        return _Files(self)
+
+    def add(self, name, parent, folder=False, content=b"", props=None):
+        with self._lock:
+            self._n += 1
+            fid = f"file-{self._n}"
+            meta = {"id": fid, "name": name, "parents": [parent] if parent else [],
+                    "mimeType": "application/vnd.google-apps.folder" if folder else "application/octet-stream",
+                    "content": content, "md5Checksum": hashlib.md5(content).hexdigest(),
+                    "modifiedTime": datetime.datetime.now().isoformat(), "webViewLink": f"https://drive.example/{fid}",
+                    "appProperties": dict(props or {})}
+            self.store[fid] = meta
+        return {"id": fid, "webViewLink": meta["webViewLink"]}
+
+    def touch(self, fid):
+        with self._lock:
+            meta = self.store[fid]
+            meta["version"] = str(int(meta.get("version", "0")) + 1)
+
+    def meta(self, fid):
+        return {k: v for k, v in self.store[fid].items() if k != "content"}
+
+    def query(self, q):
+        name = re.search(r"name = '([^']*)'", q)
+        parent = re.search(r"'([^']*)' in parents", q)
+        folder = "mimeType = 'application/vnd.google-apps.folder'" in q
+        prop = re.search(r"appProperties has \{ key='([^']*)' and value='([^']*)' \}", q)
+        out = []
+        for meta in list(self.store.values()):
+            if name and meta["name"] != name.group(1): continue
+            if parent and parent.group(1) not in meta["parents"]: continue
+            if folder and meta["mimeType"] != "application/vnd.google-apps.folder": continue
+            if prop and meta.get("appProperties", {}).get(prop.group(1)) != prop.group(2): continue
+            out.append(self.meta(meta["id"]))
+        return out
+
+
+# --- TESTDATEN ---
+
+NAMES = ["Bach", "Mozart", "Dvořák", "Strauß", "Sousa", "Holst", "Williams", "Fučík", "Müller", "Teike"]
+
+def make_repertoire(n, seed=0):
+    rnd = random.Random(seed)
+    rows = [db.HEADERS["Repertoire"]]
+    for i in range(1, n + 1):
+        arr = rnd.choice(NAMES + [""] * 5)
+        rows.append([str(i), f"Marsch Nr. {i}", rnd.choice(NAMES), "Johann", arr, "Hans" if arr else "",
+                     f"0{rnd.randint(2, 7)}:{rnd.randint(0, 59):02d}", "Verlag", "U-Musik"])
+    return rows
+
+def make_locations(n=50):
+    return [db.HEADERS["Locations"]] + [[str(i), f"Halle {i}", "Hauptstr. 1", str(10000 + i), f"Stadt {i % 20}"] for i in range(1, n + 1)]
+
+def make_events(n, rep_size, seed=0):
+    rnd = random.Random(seed)
+    start = datetime.date(2010, 1, 1)
+    rows = [db.HEADERS["Events"]]
+    for i in range(1, n + 1):
+        d = start + datetime.timedelta(days=rnd.randint(0, 5000))
+        songs = ",".join(str(rnd.randint(1, max(1, rep_size))) for _ in range(rnd.randint(8, 25)))
+        link = f"https://drive.example/e{i}" if rnd.random() < 0.8 else "Lokal (Upload Limit)"
+        rows.append([str(i), d.strftime("%d.%m.%Y"), "19:00", "Tutti", f"Halle {rnd.randint(1, 50)}", "Hauptstr. 1",
+                     "10001", f"Stadt {rnd.randint(0, 19)}", f"Tutti{d:%d.%m.%Y}Setlist.xlsx", songs, link])
+    return rows
+
+# pro Datenzeile verbundene Spalten: B, E, J und P/Q liegen mitten in einem Merge
+DATA_MERGES = [(1, 3), (4, 5), (9, 10), (15, 17)]
+
+def make_template(merged_rows=100):
+    """GEMA-ähnliches Formular: Sternchen in Zeile 19/20, Datenfelder in verbundenen Zellen."""
+    wb = openpyxl.Workbook(); ws = wb.active
+    for r in (19, 20):
+        for c in (2, 4, 6, 7, 11, 12): ws.cell(r, c).value = "Pflichtfeld *"
+        ws.merge_cells(start_row=r, start_column=11, end_row=r, end_column=12)
+    for r in range(1, 19): ws.merge_cells(start_row=r, start_column=1, end_row=r, end_column=12)
+    for r in range(21, merged_rows):
+        for c0, c1 in DATA_MERGES: ws.merge_cells(start_row=r, start_column=c0, end_row=r, end_column=c1)
+    buf = BytesIO(); wb.save(buf)
+    return buf.getvalue()
+
+
+def make_world(rep_size, event_count, latency=0.0, quota_rate=0.0):
+    """Backend, Drive (mit Template) und Tabelle mit den angegebenen Größen."""
+    backend = Backend(latency=latency, quota_rate=quota_rate)
+    drive = FakeDrive(backend)
+    template_id = drive.add("GEMA_Formular.xlsx", drive.templates_id, content=make_template())["id"]
+    sheet = FakeSpreadsheet(backend, drive, {
+        "Repertoire": make_repertoire(rep_size),
+        "Locations": make_locations(),
+        "Events": make_events(event_count, rep_size),
+    })
+    return SimpleNamespace(backend=backend, drive=drive, sheet=sheet, template_id=template_id)
@@ -0,0 +1,57 @@
+"""Die alte Zellschreiberei vor ``excel.CompiledTemplate``, nur noch als Vergleich für ``bench.run``.
+
+Pro Zelle wird bei einer ``MergedCell`` linear durch ``ws.merged_cells.ranges`` gesucht.
+"""
+from openpyxl.cell.cell import MergedCell
+from openpyxl.styles import Font
+
+from excel import DATA_FIELDS, END_ROW, START_ROW
+
+def safe_write(ws, row, col, value):
+    try:
+        cell = ws.cell(row=row, column=col)
+        if isinstance(cell, MergedCell):
+            for r in ws.merged_cells.ranges:
+                if cell.coordinate in r:
+                    ws.cell(r.min_row, r.min_col).value = value; break
+        else: cell.value = value
+    except: pass
+
+def repair_red_stars(ws):
+    """
+    Malt die Sternchen in den Zeilen 19/20 wieder rot an.
+    Betroffene Zellen laut User: B, D, F, G, K, L in Zeilen 19 & 20
+    """
+    red_font = Font(color="FF0000", bold=True) # Rot und Fett
+    
+    # Spalten-Indices (B=2, D=4, F=6, G=7, K=11, L=12)
+    target_cols = [2, 4, 6, 7, 11, 12] 
+    target_rows = [19, 20]
+    
+    for r in target_rows:
+        for c in target_cols:
+            try:
+                # Wir holen die Zelle. Wenn Merged, müssen wir den "Chef" finden
+                cell = ws.cell(row=r, column=c)
+                if isinstance(cell, MergedCell):
+                    for rng in ws.merged_cells.ranges:
+                        if cell.coordinate in rng:
+                            cell = ws.cell(rng.min_row, rng.min_col)
+                            break
+                
+                # Wir färben den Text in der Zelle rot
+                # ACHTUNG: Das färbt den GANZEN Text in der Zelle rot.
+                # Wenn da steht "Titel *", wird alles rot. 
+                # Das ist der Kompromiss, da "RichText" (nur das Sternchen rot) sehr komplex ist.
+                if cell.value:
+                    cell.font = red_font
+            except:
+                pass
+
+def fill(ws, songs_list):
+    """Leeren, Befüllen und Sternchen färben wie früher in ``process_and_upload_excel``."""
+    for r in range(START_ROW, END_ROW):
+        for c, _ in DATA_FIELDS: safe_write(ws, r, c, None)
+    for i, song in enumerate(songs_list):
+        for c, key in DATA_FIELDS: safe_write(ws, START_ROW + i, c, song[key])
+    repair_red_stars(ws)
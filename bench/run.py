@@ -0,0 +1,255 @@
+"""Offline-Benchmarks gegen die In-Memory-Fakes aus ``bench.fakes``.
+
+    python -m bench.run                       # Repertoire 100/10k/100k, Events 1k/10k
+    python -m bench.run --sizes 100 --events 500 --json
+
+Gemessen werden die Bausteine hinter den App-Funktionen (``app.py`` startet beim Import
+Streamlit): ``db.Snapshot`` für ``get_data_*``, Template-Cache/Render/``UploadQueue`` für
+``process_and_upload_excel``, ``bench.legacy`` (``safe_write``) gegen ``CompiledTemplate``,
+``ArchiveIndex`` samt Formatierung einer Archiv-Seite, ein ``db.Batch``-Write und zwei
+gleichzeitige Schreiber (ID-Konflikte).
+Pro Szenario: Wall-Zeit und API-Calls (inkl. Retries) an die Fakes. Schnelle und alte bzw.
+inkrementelle und volle Variante werden zusätzlich auf gleiches Ergebnis geprüft.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import openpyxl
+
+import api
+import archive
+import db
+import drive
+import excel
+import export
+import metrics
+import replica
+import search
+import setlist
+import stats
+from bench import fakes, legacy
+
+_results = []
+_throttle = False
+
+
+def _api():
+    # Standard: praktisch unbegrenzte Buckets und kurzes Backoff, gemessen wird der Code statt
+    # des Wartens auf Quota. Mit --throttle gelten die echten Minuten-Kontingente.
+    if _throttle: return api.Api(base=0.001, cap=0.01)
+    unlimited = {"sheets": api.TokenBucket(10**9, burst=10**6), "drive": api.TokenBucket(10**9, burst=10**6)}
+    return api.Api(buckets=unlimited, retries=5, base=0.001, cap=0.01)
+
+def _services(world, check_interval=30, store=None):
+    a = _api()
+    sh = api.SpreadsheetProxy(world.sheet, a)
+    dr = api.DriveProxy(world.drive, a)
+    return db.Snapshot(sh, dr, check_interval=check_interval, store=store), drive.DriveCache(dr)
+
+def check(ok, what):
+    """Eine schnellere Variante zählt nur, wenn sie dasselbe liefert (auch mit ``python -O``)."""
+    if not ok: raise AssertionError(what)
+
+def measure(scenario, size, world, fn):
+    """Führt ``fn()`` aus und notiert Wall-Zeit, API-Calls und Quota-Fehler."""
+    calls0 = world.backend.total()
+    errors0 = metrics.counters().get("api.error.quota", 0)
+    t0 = time.perf_counter()
+    result = fn()
+    ms = (time.perf_counter() - t0) * 1000
+    row = {"scenario": scenario, "size": size, "ms": round(ms, 1), "api_calls": world.backend.total() - calls0,
+           "quota_errors": metrics.counters().get("api.error.quota", 0) - errors0}
+    _results.append(row)
+    print(f"{scenario:<34} {size:>8} {row['ms']:>10.1f} {row['api_calls']:>6} {row['quota_errors']:>6}", flush=True)
+    return result
+
+# --- SZENARIEN ---
+
+def bench_data(rep_size, event_count, latency=0.0):
+    """``get_data_*``: kalter Load, warmer Zugriff, Versions-Check und Reload nach fremdem Write."""
+    world = fakes.make_world(rep_size, event_count, latency=latency)
+    snap, dc = _services(world)
+    size = f"{rep_size}"
+    measure("get_data cold", size, world, lambda: [snap.get(n) for n in db.SHEETS])
+    measure("get_data warm", size, world, lambda: [snap.get(n) for n in db.SHEETS])
+    snap.check_interval = 0
+    measure("get_data revision check", size, world, lambda: [snap.get(n) for n in db.SHEETS])
+    world.sheet.values_append("Locations!A1", body={"values": [["999", "Fremd"]]})
+    measure("get_data reload after write", size, world, lambda: [snap.get(n) for n in db.SHEETS])
+    snap.check_interval = 30
+    bench_replica(world, rep_size)
+    return world, snap, dc
+
+def bench_replica(world, rep_size):
+    """SQLite-Replika: erster Load schreibt sie, ein Neustart baut nur noch aus der Datei."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "replica.sqlite")
+        first, _ = _services(world, store=replica.SqliteReplica(path, db.SHEETS))
+        measure("get_data cold + replica write", rep_size, world, lambda: [first.get(n) for n in db.SHEETS])
+        first.store.close()
+        restarted, _ = _services(world, store=replica.SqliteReplica(path, db.SHEETS))
+        measure("get_data restart from replica", rep_size, world, lambda: [restarted.get(n) for n in db.SHEETS])
+        restarted.store.close()
+
+def bench_search(world, snap, rep_size):
+    df = snap.get("Repertoire")
+    idx = measure("repertoire index build", rep_size, world, lambda: search.RepertoireIndex(df))
+    measure("repertoire search x100", rep_size, world, lambda: [idx.search(q, 100) for q in ["mar", "dvorak", "marsch 12", "so"] * 25])
+    return idx
+
+def bench_generate(world, snap, dc, idx, rounds=3):
+    """``setlist.generate`` wie bei 'Fertigstellen': Template, Render, Events-Zeile, Upload mit File_Link."""
+    songs = [idx.row_by_id(i) for i in range(1, 26) if idx.row_by_id(i)]
+    uploader = drive.UploadQueue(dc, workers=2)
+
+    def generate():
+        save_event = lambda link: setlist.append_event(snap, ["01.01.2030", "19:00", "Bench", "Halle", "", "", "", "Bench.xlsx", "1,2,3", link])
+        _, job, err = setlist.generate(dc, uploader, snap, world.template_id, songs, "Bench.xlsx", save_event)
+        check(err is None, f"generate: {err}")
+        while uploader.status(job)["state"] in ("pending", "running"): time.sleep(0.001)
+        return uploader.status(job)
+
+    excel._compiled.clear()
+    measure("generate+upload cold", len(songs), world, generate)
+    for _ in range(rounds): status = measure("generate+upload warm", len(songs), world, generate)
+    if status["state"] != "done": print(f"  Upload fehlgeschlagen: {status['error']}", file=sys.stderr)
+
+def bench_excel(world, idx, song_count=25, rounds=5):
+    """Alte Zellschreiberei aus ``bench.legacy`` gegen ``CompiledTemplate.fill``."""
+    template = world.drive.store[world.template_id]["content"]
+    songs = [idx.row_by_id(i) for i in range(1, song_count + 1) if idx.row_by_id(i)]
+    tpl = excel.CompiledTemplate(template)
+    check(any(tpl.anchor(excel.START_ROW, c) != (excel.START_ROW, c) for c, _ in excel.DATA_FIELDS),
+          "Template ohne verbundene Datenzellen: safe_write würde nie auf eine MergedCell treffen")
+    # Laden gehört nicht zur Messung, beide Varianten bekommen frische Arbeitsblätter
+    sheets = lambda: [openpyxl.load_workbook(BytesIO(template)).active for _ in range(rounds)]
+
+    ws_legacy, ws_compiled = sheets(), sheets()
+    measure(f"excel legacy safe_write x{rounds}", len(songs), world, lambda: [legacy.fill(ws, songs) for ws in ws_legacy])
+    measure(f"excel compiled fill x{rounds}", len(songs), world, lambda: [tpl.fill(ws, songs) for ws in ws_compiled])
+    # Font-Objekte sind Proxys ohne Wertvergleich: fett und Farbe reichen für die Sternchen
+    cells = lambda ws: [(c.coordinate, c.value, c.font.b, c.font.color and c.font.color.rgb) for row in ws.iter_rows() for c in row]
+    check(all(cells(a) == cells(b) for a, b in zip(ws_legacy, ws_compiled)), "excel: compiled fill weicht von safe_write ab")
+
+def bench_archive(world, snap, event_count):
+    """Archiv-Index bauen und eine Seite mit allen Monaten aufgeklappt formatieren."""
+    df = snap.get("Events")
+    arch = measure("archive index build", event_count, world, lambda: archive.ArchiveIndex(df))
+
+    render_page = lambda: [arch.line(i) for _, _, pos in archive.page(arch.months(arch.select()), 1) for i in pos]
+
+    measure("archive page render", event_count, world, render_page)
+    measure("archive filter by location", event_count, world, lambda: arch.months(arch.select(None, None, "Halle 7")))
+
+    usage = measure("stats rebuild", event_count, world, lambda: stats.UsageStats().sync(snap))
+    batch = db.Batch(snap)
+    batch.update("Events", 1, ["01.01.2020", "19:00", "Tutti", "Halle 1", "", "", "", "Bench.xlsx", "1,2,3"], start_col=2)
+    batch.insert("Events", ["02.01.2020", "19:00", "BQ", "Halle 2", "", "", "", "Bench.xlsx", "3,4", "Lokal"])
+    batch.flush()
+    measure("stats incremental (2 events)", event_count, world, lambda: usage.sync(snap))
+    fresh = stats.UsageStats().sync(snap)
+    check(fresh._plays == usage._plays and fresh._events == usage._events, "stats: inkrementell weicht vom Neuaufbau ab")
+    measure("stats report by year", event_count, world, lambda: usage.report(snap.get("Repertoire"), ("Jahr",)))
+
+    idx = search.RepertoireIndex(snap.get("Repertoire"))
+    measure("export csv (all events)", event_count, world, lambda: export.to_file(export.write_csv, df, idx).close())
+    measure("export xlsx (1000 events)", min(event_count, 1000), world, lambda: export.to_file(export.write_xlsx, df.head(1000), idx).close())
+
+def bench_write(world, snap):
+    """Ein ``db.Batch`` mit einem Update und zwei Inserts."""
+    def write():
+        batch = db.Batch(snap)
+        batch.update("Locations", 1, ["Halle 1 (neu)"], start_col=2)
+        batch.insert("Repertoire", ["Neuer Marsch", "Teike", "Carl", "", "", "03:00", "Verlag", "U-Musik"])
+        batch.insert("Repertoire", ["Noch einer", "Teike", "Carl", "", "", "03:00", "Verlag", "U-Musik"])
+        batch.flush()
+    measure("batch write (1 update, 2 inserts)", len(snap.get("Repertoire")), world, write)
+
+def bench_conflicts(rep_size, event_count):
+    """Zwei Schreiber: fremder Append vor bzw. mitten in unserem Flush; IDs müssen eindeutig bleiben."""
+    world = fakes.make_world(rep_size, event_count)
+    snap, _ = _services(world)
+    snap.get("Locations")
+    rows = world.sheet.data["Locations"]
+    unique = lambda: len({r[0] for r in rows[1:]}) == len(rows) - 1
+    own = lambda name: next(r[0] for r in rows if r[1:2] == [name])
+
+    # fremder Append innerhalb von check_interval: der Snapshot kennt ihn beim insert() noch nicht
+    world.sheet.values_append("Locations!A1", body={"values": [[str(snap.max_ids["Locations"] + 1), "Fremd 1"]]})
+    batch = db.Batch(snap); placeholder = batch.insert("Locations", ["Eigen 1"])
+    measure("conflict: foreign append before flush", "Locations", world, batch.flush)
+    check(unique() and str(batch.final_id("Locations", placeholder)) == own("Eigen 1"), "conflict: doppelte ID nach fremdem Append")
+
+    # fremder Append zwischen Versions-Check und unserem Append: ``_resolve`` nummeriert um
+    append = world.sheet.values_append
+    def racing(range, params=None, body=None):
+        world.sheet.values_append = append
+        append(range, body={"values": [[str(body["values"][0][0]), "Fremd 2"]]})
+        return append(range, params=params, body=body)
+    world.sheet.values_append = racing
+    batch = db.Batch(snap); placeholder = batch.insert("Locations", ["Eigen 2"])
+    measure("conflict: foreign append during flush", "Locations", world, batch.flush)
+    check(unique() and str(batch.final_id("Locations", placeholder)) == own("Eigen 2"), "conflict: _resolve hat nicht umnummeriert")
+    check(snap.values["Locations"] == rows, "conflict: Snapshot weicht vom Sheet ab")
+
+    # fremder Append direkt nach unserem: die neue Version ist nicht nur unsere, er muss ankommen
+    def trailing(range, params=None, body=None):
+        world.sheet.values_append = append
+        resp = append(range, params=params, body=body)
+        append(range, body={"values": [["9999", "Fremd 3"]]})
+        return resp
+    world.sheet.values_append = trailing
+    batch = db.Batch(snap); batch.insert("Locations", ["Eigen 3"])
+    measure("conflict: foreign append after flush", "Locations", world, batch.flush)
+    check(snap.values["Locations"] == rows, "conflict: fremder Append nach eigenem Write fehlt im Snapshot")
+
+def bench_quota(rep_size, event_count, rate, latency=0.0):
+    """Dieselben Pfade, aber jeder Call scheitert mit Wahrscheinlichkeit ``rate`` an Quota (429)."""
+    world = fakes.make_world(rep_size, event_count, latency=latency, quota_rate=rate)
+    snap, dc = _services(world, check_interval=0)
+    label = f"{rep_size}@{rate:.0%}"
+    measure("quota: get_data cold", label, world, lambda: [snap.get(n) for n in db.SHEETS])
+    measure("quota: get_data x50 (rev check)", label, world, lambda: [snap.get("Events") for _ in range(50)])
+    measure("quota: template listing+bytes", label, world, lambda: dc.template_bytes(world.template_id))
+    bench_write(world, snap)
+
+# --- MAIN ---
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="GEMA-App Benchmarks gegen In-Memory-Fakes")
+    p.add_argument("--sizes", default="100,10000,100000", help="Repertoire-Größen, kommagetrennt")
+    p.add_argument("--events", default="1000,10000", help="Event-Anzahlen, kommagetrennt")
+    p.add_argument("--latency", type=float, default=0.0, help="simulierte Latenz pro Call in Sekunden")
+    p.add_argument("--quota-rate", type=float, default=0.2, help="Fehlerquote für das Quota-Szenario")
+    p.add_argument("--throttle", action="store_true", help="echte Token-Buckets (60/600 pro Minute) verwenden")
+    p.add_argument("--json", action="store_true", help="Ergebnisse zusätzlich als JSON ausgeben")
+    args = p.parse_args(argv)
+    global _throttle
+    _throttle = args.throttle
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    events = [int(s) for s in args.events.split(",") if s]
+
+    print(f"{'Szenario':<34} {'Größe':>8} {'ms':>10} {'Calls':>6} {'429':>6}")
+    for rep_size in sizes:
+        world, snap, dc = bench_data(rep_size, events[0], args.latency)
+        idx = bench_search(world, snap, rep_size)
+        bench_write(world, snap)
+    bench_generate(world, snap, dc, idx)
+    bench_excel(world, idx)
+    for event_count in events:
+        world = fakes.make_world(sizes[0], event_count, latency=args.latency)
+        snap, _ = _services(world)
+        bench_archive(world, snap, event_count)
+    bench_conflicts(sizes[0], events[0])
+    bench_quota(sizes[0], events[0], args.quota_rate, args.latency)
+
+    if args.json: print(json.dumps(_results, ensure_ascii=False, indent=1))
+
+
+if __name__ == "__main__":
+    main()
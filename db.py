@@ -0,0 +1,394 @@
+"""Datenbank-Schicht: Repertoire, Locations und Events als gemeinsamer Snapshot.
+
+Alle drei Tabellenblätter kommen aus einem einzigen ``values:batchGet``. Ob sich seit dem
+letzten Laden etwas geändert hat, verrät die Drive-Version der Tabelle (ein billiger
+Metadaten-Call). Beim Nachladen werden nur Blätter neu aufgebaut, deren Inhalt sich
+wirklich geändert hat.
+
+Jedes Blatt hat eine eigene Versionsnummer. Schreibzugriffe patchen die betroffene Zeile
+direkt in Rohwerte und DataFrame (inkl. ``Label``/``Datum_Obj``), statt alles zu verwerfen;
+dabei wandert nur die Version des berührten Blatts.
+
+Geschrieben wird über ``Batch``: IDs kommen aus einem prozessweiten Zähler, Zeilennummern
+aus dem ID→Zeile-Index des Snapshots. Damit braucht ein Schreibvorgang weder
+``col_values`` noch ``find`` vorab, und alle Updates gehen in einem ``values:batchUpdate`` raus.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+from gspread.utils import numericise_all, rowcol_to_a1
+
+import metrics
+
+log = logging.getLogger("gema.db")
+
+SHEETS = ["Repertoire", "Locations", "Events"]
+
+HEADERS = {
+    "Repertoire": ['ID','Titel','Komponist_Nachname','Komponist_Vorname','Bearbeiter_Nachname','Bearbeiter_Vorname','Dauer','Verlag','Werkeart','ISWC'],
+    "Locations": ['ID','Name','Strasse','PLZ','Stadt'],
+    "Events": ['Event_ID','Datum','Uhrzeit','Ensemble','Location_Name','Strasse','PLZ','Stadt','Setlist_Name','Songs_IDs','File_Link'],
+}
+
+# --- DATAFRAMES AUS ROHWERTEN ---
+
+def records_frame(values, keep_text=()):
+    """
+    Wie ``ws.get_all_records()``: Zeile 1 ist der Kopf, Zahlen werden numerisch, Lücken leer.
+    Spalten in ``keep_text`` bleiben Text (sonst würde z.B. "1,2" zur Zahl 12).
+    """
+    if not values or not values[0]: return pd.DataFrame()
+    header = values[0]; width = len(header)
+    ignore = [i + 1 for i, h in enumerate(header) if h in keep_text]
+    rows = [numericise_all((list(r) + [""] * width)[:width], ignore=ignore) for r in values[1:]]
+    return pd.DataFrame(rows, columns=header)
+
+def build_repertoire(values):
+    df = records_frame(values)
+    for c in ['ID','Titel','Komponist_Nachname','Bearbeiter_Nachname']:
+        if c not in df.columns: df[c]=""
+    if not df.empty:
+        df['ID'] = df['ID'].astype(str).str.replace(r'\.0$', '', regex=True)
+        arr = df['Bearbeiter_Nachname']
+        df['Label'] = df['Titel'].astype(str) + " (" + df['Komponist_Nachname'].astype(str) + ")" + ((" / Arr: " + arr.astype(str)).where(arr.map(bool), ""))
+    return df
+
+def build_locations(values):
+    df = records_frame(values)
+    return df if not df.empty else pd.DataFrame(columns=HEADERS["Locations"])
+
+def build_events(values):
+    df = records_frame(values, keep_text=('Songs_IDs',))
+    if not df.empty and 'Datum' in df.columns: df['Datum_Obj'] = pd.to_datetime(df['Datum'], format="%d.%m.%Y", errors='coerce')
+    return df
+
+BUILDERS = {"Repertoire": build_repertoire, "Locations": build_locations, "Events": build_events}
+
+def _norm_id(v):
+    return str(v).strip().replace('.0','')
+
+def _cell(v):
+    """Rohwert so, wie Sheets ihn nach einem RAW-Write formatiert zurückgibt."""
+    return "" if v is None else str(v)
+
+def _plain(v):
+    """numpy-Skalare (z.B. aus ``row['Event_ID']``) in JSON-taugliche Werte wandeln."""
+    return v.item() if hasattr(v, "item") else v
+
+def _trim(row):
+    """Sheets liefert Zeilen ohne leere Zellen am Ende zurück."""
+    row = list(row)
+    while row and row[-1] == "": row.pop()
+    return row
+
+def _digest(values):
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+# --- SNAPSHOT ---
+
+CHANGELOG_SIZE = 500
+
+class Snapshot:
+    """Prozessweiter Stand der drei Blätter, geteilt von allen Sessions.
+
+    ``check_interval`` begrenzt, wie oft (Sekunden) die Drive-Version abgefragt wird;
+    dazwischen liefert ``get`` den vorhandenen Stand ohne jeden API-Call.
+
+    ``store`` ist ein optionales lokales Backend (z.B. ``replica.SqliteReplica``): jeder neue
+    Stand wird zeilenweise dorthin gespiegelt, und ein Kaltstart beginnt mit dessen Inhalt.
+    """
+
+    def __init__(self, sh, drive_service, check_interval=30, store=None):
+        self.sh = sh
+        self.drive = drive_service
+        self.check_interval = check_interval
+        self.store = store
+        self.frames = {}
+        self.values = {}
+        self.hashes = {}
+        self.versions = {name: 0 for name in SHEETS}
+        # (version, ID der gepatchten Zeile bzw. None bei komplettem Neuaufbau) je Blatt
+        self.changelog = {name: deque(maxlen=CHANGELOG_SIZE) for name in SHEETS}
+        self.row_index = {}
+        self.max_ids = {}
+        self._next_ids = {}
+        self.revision = None
+        self.checked_at = 0.0
+        self._lock = threading.RLock()
+        self.write_lock = threading.Lock()
+
+    def fetch_revision(self):
+        """Aktuelle Drive-Version der Tabelle (None, falls nicht ermittelbar)."""
+        try:
+            return self.drive.files().get(fileId=self.sh.id, fields="version").execute().get("version")
+        except Exception as e:
+            # Ohne Version wird einfach voll geladen; der Fehler soll aber sichtbar bleiben
+            log.warning("Revisions-Check fehlgeschlagen: %s", e)
+            return None
+
+    def load(self, revision=None):
+        """Holt alle Blätter mit einem Request; gibt die Namen der geänderten Blätter zurück."""
+        with self._lock, metrics.span("snapshot.load"):
+            resp = self.sh.values_batch_get(SHEETS)
+            changed = []
+            for name, vr in zip(SHEETS, resp.get("valueRanges", [])):
+                values = vr.get("values", [])
+                h = _digest(values)
+                # nach eigenen Patches fehlt der Digest: dann direkt mit den gepatchten Werten vergleichen
+                old = self.hashes.get(name)
+                if name in self.frames and (old == h if old is not None else self.values[name] == values):
+                    self.hashes[name] = h; continue
+                self._set(name, values, BUILDERS[name](values), h)
+                changed.append(name)
+            self.revision = revision
+            self.checked_at = time.time()
+            if self.store is not None:
+                try: self.store.set_revision(revision)
+                except Exception as e: log.warning("Replika nicht aktualisiert: %s", e)
+            return changed
+
+    def restore(self):
+        """Kaltstart aus ``store``; True, wenn alle Blätter von dort kamen."""
+        if self.store is None: return False
+        try: revision, stored = self.store.read(self.sh.id)
+        except Exception as e:
+            log.warning("Replika nicht lesbar: %s", e); return False
+        if any(not stored.get(name) for name in SHEETS): return False
+        with self._lock, metrics.span("snapshot.restore"):
+            for name in SHEETS: self._set(name, stored[name], BUILDERS[name](stored[name]), persist=False)
+            self.revision = revision
+            self.checked_at = 0.0
+        metrics.count("cache.snapshot.restored")
+        return True
+
+    def refresh(self, force=False, recheck=False):
+        """Lädt nach, wenn sich die Tabelle geändert hat (oder ``force``); ``recheck`` prüft ohne Intervall."""
+        with self._lock:
+            loaded = len(self.frames) == len(SHEETS) or self.restore()
+            if loaded and not force and not recheck and time.time() - self.checked_at < self.check_interval:
+                metrics.count("cache.snapshot.hit"); return []
+            # billiger Check ohne Datentransfer: nur bei abweichender (oder unbekannter) Version laden
+            rev = self.fetch_revision()
+            if loaded and not force and rev is not None and rev == self.revision:
+                metrics.count("cache.snapshot.hit")
+                self.checked_at = time.time(); return []
+            metrics.count("cache.snapshot.miss")
+            return self.load(rev)
+
+    def invalidate(self):
+        """Erzwingt beim nächsten Zugriff einen Versions-Check."""
+        with self._lock:
+            self.revision = None; self.checked_at = 0.0
+
+    def missing_headers(self):
+        """Blätter, deren Zeile 1 im geladenen Stand leer ist."""
+        return [name for name in SHEETS if not self.values.get(name) or not self.values[name][0]]
+
+    def get(self, name):
+        self.refresh()
+        return self.frames[name]
+
+    def version(self, name):
+        return self.versions[name]
+
+    def changes_since(self, name, version):
+        """
+        (aktuelle Version, Zeilen, inkrementell) für Abnehmer, die auf Stand ``version`` sind:
+        nur die seither gepatchten Zeilen, oder das ganze Blatt, wenn dazwischen neu geladen
+        wurde bzw. der Verlauf nicht mehr so weit zurückreicht.
+        """
+        with self._lock:
+            current = self.versions[name]
+            entries = [(v, k) for v, k in self.changelog[name] if version is not None and v > version]
+            if version is None or len(entries) != current - version or any(k is None for _, k in entries):
+                return current, self.frames[name], False
+            rows = [self.row_of(name, k) for k in dict.fromkeys(k for _, k in entries)]
+            return current, self.frames[name].iloc[[r - 2 for r in rows if r]], True
+
+    def _set(self, name, values, df, h=None, persist=True, key=None):
+        if persist and self.store is not None:
+            try: self.store.write_rows(self.sh.id, name, self.values.get(name) or [], values)
+            except Exception as e: log.warning("Replika nicht aktualisiert (%s): %s", name, e)
+        self.values[name] = values
+        self.frames[name] = df
+        self.hashes[name] = h or _digest(values)
+        self.versions[name] += 1
+        self.changelog[name].append((self.versions[name], key))
+        index = {}
+        for i, r in enumerate(values[1:], start=2):
+            if r and _norm_id(r[0]): index[_norm_id(r[0])] = i
+        self.row_index[name] = index
+        self.max_ids[name] = max((int(k) for k in index if k.isdigit()), default=0)
+
+    def _patch(self, name, values, df, row_no, old_key=None):
+        """
+        ``_set`` für eine einzelne geänderte Zeile ``row_no``: Index, Max-ID und Replika nur
+        für diese Zeile; den Digest des ganzen Blatts holt erst der nächste ``load`` nach.
+        """
+        row = values[row_no - 1]
+        key = _norm_id(row[0]) if row else None
+        if self.store is not None:
+            try: self.store.write_row(self.sh.id, name, row_no, row)
+            except Exception as e: log.warning("Replika nicht aktualisiert (%s): %s", name, e)
+        self.values[name] = values
+        self.frames[name] = df
+        self.hashes[name] = None
+        self.versions[name] += 1
+        self.changelog[name].append((self.versions[name], key))
+        index = self.row_index.setdefault(name, {})
+        if old_key and old_key != key and index.get(old_key) == row_no: del index[old_key]
+        if key:
+            index[key] = row_no
+            if key.isdigit(): self.max_ids[name] = max(self.max_ids.get(name, 0), int(key))
+
+    # --- ID-ZÄHLER & ZEILEN-INDEX ---
+
+    def row_of(self, name, key):
+        """Zeilennummer (1-basiert, wie in Sheets) der Zeile mit ID ``key`` oder None."""
+        return self.row_index.get(name, {}).get(_norm_id(key))
+
+    def allocate_id(self, name):
+        """Nächste freie ID; vergibt innerhalb des Prozesses nie dieselbe ID zweimal."""
+        with self._lock:
+            new_id = max(self.max_ids.get(name, 0), self._next_ids.get(name, 0)) + 1
+            self._next_ids[name] = new_id
+            return new_id
+
+    def _row_frame(self, name, row):
+        """Baut eine einzelne Zeile mit denselben abgeleiteten Spalten wie das ganze Blatt."""
+        return BUILDERS[name]([self.values[name][0], row])
+
+    # --- PATCHES NACH ERFOLGREICHEM SCHREIBEN ---
+
+    def apply_append(self, name, row):
+        """Hängt eine neu geschriebene Zeile an Rohwerte und DataFrame an."""
+        with self._lock:
+            if name not in self.frames or not self.values[name]: self.invalidate(); return
+            row = _trim(_cell(v) for v in row)
+            values = self.values[name] + [row]
+            df = self.frames[name]
+            new = self._row_frame(name, row)
+            df = new if df.empty else pd.concat([df, new], ignore_index=True)
+            self._patch(name, values, df, len(values))
+
+    def apply_update(self, name, key, cells, start_col=1):
+        """Überschreibt ab Spalte ``start_col`` (1-basiert) die Zeile mit ID ``key``."""
+        with self._lock:
+            if name not in self.frames: self.invalidate(); return
+            values = self.values[name]
+            row_no = self.row_of(name, key)
+            if row_no is None: self.invalidate(); return
+            pos = row_no - 1
+            width = max(len(values[0]), start_col - 1 + len(cells))
+            row = (list(values[pos]) + [""] * width)[:width]
+            row[start_col-1:start_col-1+len(cells)] = [_cell(v) for v in cells]
+            row = _trim(row)
+            values = values[:pos] + [row] + values[pos+1:]
+            df = self.frames[name]
+            df = pd.concat([df.iloc[:pos-1], self._row_frame(name, row), df.iloc[pos:]], ignore_index=True)
+            self._patch(name, values, df, row_no, old_key=_norm_id(key))
+
+
+# --- SCHREIBEN ---
+
+def write_headers(snap, names):
+    """Schreibt die Standard-Kopfzeilen für ``names`` in einem Request und lädt neu."""
+    data = [{"range": f"{name}!A1", "values": [HEADERS[name]]} for name in names]
+    snap.sh.values_batch_update({"valueInputOption": "RAW", "data": data})
+    snap.load(snap.fetch_revision())
+
+class Batch:
+    """Sammelt Inserts und Updates und schreibt sie gebündelt.
+
+    Updates gehen in einen einzigen ``values:batchUpdate``, Inserts pro Blatt in ein
+    ``values:append``. Erst nach erfolgreichem Schreiben wird der Snapshot gepatcht.
+
+    IDs neuer Zeilen werden erst in ``flush`` vergeben, nach dem Versions-Check und unter
+    ``write_lock``: so zählen fremde Appends bis kurz vor dem Schreiben schon mit. Landet ein
+    Append trotzdem nicht in der erwarteten Zeile, hat in diesem Moment jemand anderes
+    geschrieben: dann wird neu geladen und eine doppelt vergebene ID nachträglich ersetzt.
+    """
+
+    def __init__(self, snapshot):
+        self.snap = snapshot
+        self.inserts = {}
+        self.updates = []
+        self.ids = {}
+        self._n = 0
+
+    def insert(self, name, cells):
+        """Reiht eine neue Zeile ein; gibt einen Platzhalter zurück, die ID liefert ``final_id``."""
+        self._n += 1; placeholder = f"neu-{self._n}"
+        self.inserts.setdefault(name, []).append((placeholder, [_plain(c) for c in cells]))
+        return placeholder
+
+    def update(self, name, key, cells, start_col=1):
+        self.updates.append((name, key, [_plain(c) for c in cells], start_col))
+
+    def final_id(self, name, placeholder):
+        """Vergebene ID (nach einer eventuellen Konfliktauflösung) zum Platzhalter aus ``insert``."""
+        return self.ids.get((name, placeholder))
+
+    def flush(self):
+        if not self.inserts and not self.updates: return
+        with self.snap.write_lock, metrics.span("sheets.flush"): self._flush()
+
+    def _flush(self):
+        snap = self.snap; sh = snap.sh
+        # Zeilennummern kommen aus dem Snapshot: vor dem Schreiben die Version sofort prüfen, sonst
+        # trifft ein Update nach fremdem Löschen bis zu ``check_interval`` lang die falsche Zeile
+        snap.refresh(recheck=True)
+        data = []
+        for name, key, cells, start_col in self.updates:
+            row = snap.row_of(name, key)
+            if row is None: raise KeyError(f"{name}: ID {key} nicht gefunden")
+            rng = f"{rowcol_to_a1(row, start_col)}:{rowcol_to_a1(row, start_col + len(cells) - 1)}"
+            data.append({"range": f"{name}!{rng}", "values": [cells]})
+        if data: sh.values_batch_update({"valueInputOption": "RAW", "data": data})
+        for name, key, cells, start_col in self.updates: snap.apply_update(name, key, cells, start_col)
+        self.updates = []
+
+        conflicts = {}
+        for name, pending in self.inserts.items():
+            rows = []
+            for placeholder, cells in pending:
+                self.ids[(name, placeholder)] = new_id = snap.allocate_id(name)
+                rows.append([new_id] + cells)
+            expected = len(snap.values.get(name, [])) + 1
+            resp = sh.values_append(f"{name}!A1", params={"valueInputOption": "RAW"}, body={"values": rows})
+            m = re.search(r"![A-Z]+(\d+)", resp.get("updates", {}).get("updatedRange", ""))
+            start = int(m.group(1)) if m else None
+            if start == expected:
+                for r in rows: snap.apply_append(name, r)
+            else:
+                conflicts[name] = (start, rows, [p for p, _ in pending])
+        self.inserts = {}
+        if conflicts: self._resolve(conflicts)
+        # Ob die neue Version nur unsere Writes enthält, weiß man nicht (zwei Nutzer speichern
+        # gleichzeitig): also laden. Blätter, die den gepatchten Werten gleichen, baut ``load``
+        # nicht neu auf, es bleibt bei einem Batch-Read statt eines Reloads beim nächsten Zugriff.
+        else: snap.load(snap.fetch_revision())
+
+    def _resolve(self, conflicts):
+        """Nach fremden Appends: Server-Stand laden und eigene Doppel-IDs umnummerieren."""
+        snap = self.snap
+        snap.load(snap.fetch_revision())
+        data = []
+        for name, (start, rows, placeholders) in conflicts.items():
+            if start is None: continue
+            values = snap.values[name]
+            for offset, (r, placeholder) in enumerate(zip(rows, placeholders)):
+                key = _norm_id(r[0])
+                if sum(1 for v in values[1:] if v and _norm_id(v[0]) == key) < 2: continue
+                new_id = snap.allocate_id(name)
+                self.ids[(name, placeholder)] = new_id
+                data.append({"range": f"{name}!{rowcol_to_a1(start + offset, 1)}", "values": [[new_id]]})
+        if data:
+            snap.sh.values_batch_update({"valueInputOption": "RAW", "data": data})
+            snap.load(snap.fetch_revision())
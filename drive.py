@@ -0,0 +1,234 @@
+"""Drive-Schicht: Ordner-IDs, Template-Listen und Template-Dateien mit Cache.
+
+Ordner-IDs und die Template-Liste werden für ``ttl`` Sekunden gemerkt. Die Template-Bytes
+liegen in einem größenbegrenzten LRU-Cache, dessen Schlüssel die Drive-``md5Checksum``
+(ersatzweise ``modifiedTime``) enthält: nur ein geändertes Template wird neu geladen.
+
+Uploads laufen über ``UploadQueue`` in einem kleinen Hintergrund-Pool, damit der
+Download-Button nicht auf Drive warten muss.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient.discovery import build
+from googleapiclient.http import MediaIoBaseUpload
+
+import metrics
+from api import ApiError
+
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+# Platzhalter in Events.File_Link, solange bzw. falls kein Drive-Link existiert
+UPLOAD_PENDING = "Lokal (Upload läuft)"
+UPLOAD_FAILED = "Lokal (Upload Limit)"
+
+
+class LazyService:
+    """
+    Drive-Client, der erst beim ersten Attributzugriff gebaut wird.
+    ``static_discovery=True`` nimmt das mit google-api-python-client ausgelieferte
+    Discovery-Dokument, es gibt also keinen Netzwerk-Call für die API-Beschreibung.
+    """
+
+    def __init__(self, credentials):
+        self._creds = credentials
+        self._service = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get(self):
+        if self._service is None:
+            with self._lock:
+                if self._service is None:
+                    self._service = build('drive', 'v3', credentials=self._creds, static_discovery=True, cache_discovery=False)
+        return self._service
+
+    def http(self):
+        """Eigene autorisierte HTTP-Verbindung pro Thread (httplib2 ist nicht thread-sicher)."""
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = google_auth_httplib2.AuthorizedHttp(self._creds, http=httplib2.Http())
+        return http
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+class DriveCache:
+    """Prozessweiter Cache vor ``drive_service.files()``, geteilt von allen Sessions."""
+
+    def __init__(self, drive_service, ttl=300, max_bytes=20 * 1024 * 1024):
+        self.drive = drive_service
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._folders = {}
+        self._listing = None
+        self._blobs = OrderedDict()
+        self._blob_size = 0
+        self._lock = threading.RLock()
+
+    def _fresh(self, stamp):
+        return time.time() - stamp < self.ttl
+
+    def invalidate(self):
+        """Vergisst Ordner-IDs und Template-Liste (Template-Bytes prüft ``_meta`` ohnehin per Checksumme)."""
+        with self._lock:
+            self._folders.clear(); self._listing = None
+
+    # --- ORDNER & LISTEN ---
+
+    def folder_id(self, folder_name, parent_id=None):
+        key = (folder_name, parent_id)
+        with self._lock:
+            hit = self._folders.get(key)
+            if hit and self._fresh(hit[1]):
+                metrics.count("cache.folder.hit"); return hit[0]
+        metrics.count("cache.folder.miss")
+        query = f"name = '{folder_name}' and mimeType = '{FOLDER_MIME}' and trashed = false"
+        if parent_id: query += f" and '{parent_id}' in parents"
+        results = self.drive.files().list(q=query, fields="files(id)").execute()
+        items = results.get('files', [])
+        fid = items[0]['id'] if items else None
+        with self._lock: self._folders[key] = (fid, time.time())
+        return fid
+
+    def list_templates(self):
+        """Dateien im Ordner 'Templates' inkl. ``md5Checksum``/``modifiedTime``; (files, fehler)."""
+        with self._lock:
+            if self._listing and self._fresh(self._listing[1]):
+                metrics.count("cache.listing.hit"); return self._listing[0], None
+        metrics.count("cache.listing.miss")
+        try: return self._list_templates()
+        except ApiError as e: return [], str(e)
+
+    def _list_templates(self):
+        root_id = self.folder_id("GEMA Bpol")
+        if not root_id: return [], "Hauptordner 'GEMA Bpol' nicht gefunden."
+        fid = self.folder_id("Templates", parent_id=root_id)
+        if not fid: fid = self.folder_id("Templates")
+        if not fid: return [], "Ordner 'Templates' nicht gefunden."
+
+        query = f"'{fid}' in parents and trashed = false"
+        results = self.drive.files().list(q=query, fields="files(id, name, md5Checksum, modifiedTime, size)").execute()
+        files = results.get('files', [])
+        with self._lock: self._listing = (files, time.time())
+        return files, None
+
+    # --- TEMPLATE-BYTES ---
+
+    def _meta(self, file_id):
+        files, _ = self.list_templates()
+        meta = next((f for f in files if f['id'] == file_id), None)
+        if meta is None:
+            meta = self.drive.files().get(fileId=file_id, fields="id, md5Checksum, modifiedTime").execute()
+        return meta
+
+    def template_key(self, file_id):
+        """Inhalts-Schlüssel eines Templates; ändert sich genau dann, wenn die Datei sich ändert."""
+        meta = self._meta(file_id)
+        return (file_id, meta.get('md5Checksum') or meta.get('modifiedTime'))
+
+    def template_bytes(self, file_id):
+        key = self.template_key(file_id)
+        with self._lock:
+            if key in self._blobs:
+                metrics.count("cache.template.hit")
+                self._blobs.move_to_end(key)
+                return self._blobs[key]
+        metrics.count("cache.template.miss")
+        content = self.drive.files().get_media(fileId=file_id).execute()
+        with self._lock:
+            for old in [k for k in self._blobs if k[0] == file_id]:
+                self._blob_size -= len(self._blobs.pop(old))
+            self._blobs[key] = content
+            self._blob_size += len(content)
+            while self._blob_size > self.max_bytes and len(self._blobs) > 1:
+                _, dropped = self._blobs.popitem(last=False)
+                self._blob_size -= len(dropped)
+        return content
+
+    # --- UPLOAD ---
+
+    def upload(self, buffer, name, parent_id, mimetype):
+        """Lädt ``buffer`` (BytesIO) direkt aus dem Speicher hoch; gibt den ``webViewLink`` zurück.
+
+        Jeder Upload trägt eine eigene Marke in ``appProperties``: scheitert ``create`` mit
+        5xx/Timeout, sucht ``Api.call`` danach, statt blind eine zweite Datei anzulegen.
+        """
+        media = MediaIoBaseUpload(buffer, mimetype=mimetype, resumable=False)
+        token = uuid.uuid4().hex
+        def verify():
+            query = f"appProperties has {{ key='gema_upload' and value='{token}' }} and trashed = false"
+            files = self.drive.files().list(q=query, fields="files(id, webViewLink)", supportsAllDrives=True,
+                                            includeItemsFromAllDrives=True).execute().get('files', [])
+            return files[0] if files else None
+        try:
+            # supportsAllDrives=True hilft manchmal bei Quota Problemen
+            file = self.drive.files().create(
+                body={'name': name, 'parents': [parent_id], 'appProperties': {'gema_upload': token}},
+                media_body=media,
+                fields='id, webViewLink',
+                supportsAllDrives=True
+            ).execute(verify=verify)
+        finally:
+            buffer.seek(0)
+        return file.get('webViewLink')
+
+
+class UploadQueue:
+    """Beschränkter Hintergrund-Pool für Uploads in 'GEMA Bpol/Output'.
+
+    Retries macht allein ``Api.call`` (inkl. Nachsehen nach einem 5xx beim Anlegen), eine
+    zweite Schleife hier würde die Versuche nur multiplizieren.
+
+    ``submit`` gibt sofort eine Job-ID zurück; ``status`` liefert den aktuellen Stand
+    (``pending``/``running``/``done``/``failed``) und ggf. den ``webViewLink``.
+    """
+
+    def __init__(self, cache, workers=2, keep=200):
+        self.cache = cache
+        self.keep = keep
+        self.jobs = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-upload")
+        self._lock = threading.Lock()
+
+    def submit(self, data, name, mimetype, on_done=None):
+        """Reiht den Upload ein; ``on_done(link)`` wird am Ende mit Link bzw. ``UPLOAD_FAILED`` gerufen."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self.jobs[job_id] = {"state": "pending", "name": name, "link": None, "error": None}
+            while len(self.jobs) > self.keep: self.jobs.popitem(last=False)
+        self._pool.submit(self._run, job_id, data, name, mimetype, on_done)
+        return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            return dict(self.jobs.get(job_id) or {"state": "unknown", "link": None, "error": None})
+
+    def _set(self, job_id, **kw):
+        with self._lock:
+            if job_id in self.jobs: self.jobs[job_id].update(kw)
+
+    def _upload(self, data, name, mimetype):
+        root_id = self.cache.folder_id("GEMA Bpol")
+        output_id = self.cache.folder_id("Output", parent_id=root_id) if root_id else None
+        if not output_id: raise ApiError("drive.files.list", "not_found")
+        return self.cache.upload(BytesIO(data), name, output_id, mimetype)
+
+    def _run(self, job_id, data, name, mimetype, on_done):
+        self._set(job_id, state="running")
+        link, error = None, None
+        try:
+            with metrics.span("upload.drive"): link = self._upload(data, name, mimetype)
+        except Exception as e: error = str(e)
+        if on_done:
+            try:
+                with metrics.span("upload.file_link"): on_done(link or UPLOAD_FAILED)
+            except Exception as e: error = error or f"File_Link nicht gespeichert: {e}"
+        self._set(job_id, state="done" if link else "failed", link=link, error=error)
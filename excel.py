@@ -0,0 +1,110 @@
+"""Excel-Schicht: befüllt GEMA-Templates komplett im Speicher (Bytes rein, BytesIO raus)."""
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import openpyxl
+from openpyxl.styles import Font # Für die roten Sternchen
+
+import metrics
+
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# --- KOMPILIERTES TEMPLATE ---
+
+# Datenbereich ab Zeile 21; Spalten B, E, F, G, J, P, Q
+START_ROW = 21
+END_ROW = 100
+DATA_FIELDS = [(2, 'Titel'), (5, 'Dauer'), (6, 'Komponist_Nachname'), (7, 'Komponist_Vorname'), (10, 'Verlag'), (16, 'Bearbeiter_Nachname'), (17, 'Bearbeiter_Vorname')]
+STAR_ROWS = [19, 20]
+STAR_COLS = [2, 4, 6, 7, 11, 12]
+
+class CompiledTemplate:
+    """
+    Einmal pro Template-Version vorberechnet: welche Zelle gehört zu welchem Merge-"Chef",
+    welche Chefs im Datenbereich geleert werden müssen und wo die roten Sternchen sitzen.
+    Damit entfällt beim Befüllen die Suche durch ``ws.merged_cells.ranges`` pro Zelle.
+    """
+
+    def __init__(self, template_bytes):
+        self.template_bytes = template_bytes
+        ws = openpyxl.load_workbook(BytesIO(template_bytes)).active
+        self.anchors = {}
+        for rng in ws.merged_cells.ranges:
+            chef = (rng.min_row, rng.min_col)
+            for r in range(rng.min_row, rng.max_row + 1):
+                for c in range(rng.min_col, rng.max_col + 1):
+                    if (r, c) != chef: self.anchors[(r, c)] = chef
+        self.clear_cells = list(dict.fromkeys(self.anchor(r, c) for r in range(START_ROW, END_ROW) for c, _ in DATA_FIELDS))
+        self.star_cells = list(dict.fromkeys(self.anchor(r, c) for r in STAR_ROWS for c in STAR_COLS))
+
+    def anchor(self, row, col):
+        return self.anchors.get((row, col), (row, col))
+
+    def fill(self, ws, songs_list):
+        """Leeren, Befüllen und Sternchen färben in einem Durchgang über die vorberechneten Zellen."""
+        for r, c in self.clear_cells: ws.cell(r, c).value = None
+        for i, song in enumerate(songs_list):
+            for c, key in DATA_FIELDS:
+                r0, c0 = self.anchor(START_ROW + i, c)
+                ws.cell(r0, c0).value = song[key]
+        red_font = Font(color="FF0000", bold=True) # Rot und Fett
+        for r, c in self.star_cells:
+            cell = ws.cell(r, c)
+            if cell.value: cell.font = red_font
+
+    def render(self, songs_list):
+        """Lädt das Template aus Bytes, trägt die Songs ein und gibt die Datei als BytesIO zurück."""
+        with metrics.span("excel.load_workbook"): wb = openpyxl.load_workbook(BytesIO(self.template_bytes))
+        with metrics.span("excel.fill"): self.fill(wb.active, songs_list)
+        output_bytes = BytesIO()
+        with metrics.span("excel.save"): wb.save(output_bytes)
+        output_bytes.seek(0)
+        return output_bytes
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+def compiled_template(key, load_bytes, max_entries=8):
+    """CompiledTemplate zum Inhalts-Schlüssel ``key`` (siehe ``DriveCache.template_key``), LRU-gecacht."""
+    with _compiled_lock:
+        if key in _compiled:
+            metrics.count("cache.compiled.hit")
+            _compiled.move_to_end(key)
+            return _compiled[key]
+    metrics.count("cache.compiled.miss")
+    with metrics.span("excel.compile"): tpl = CompiledTemplate(load_bytes())
+    with _compiled_lock:
+        _compiled[key] = tpl
+        while len(_compiled) > max_entries: _compiled.popitem(last=False)
+    return tpl
+
+# --- MASSEN-GENERIERUNG ---
+
+_worker_tpl = None
+
+def _init_worker(template_bytes):
+    global _worker_tpl
+    _worker_tpl = CompiledTemplate(template_bytes)
+
+def _render_job(songs_list):
+    return _worker_tpl.render(songs_list).getvalue()
+
+def render_many(template_bytes, song_lists, workers=None):
+    """
+    Rendert viele Setlists aus einem Template parallel in einem Prozess-Pool (Reihenfolge bleibt).
+    Jeder Worker kompiliert das Template genau einmal. Kleine Mengen laufen direkt im Prozess,
+    weil der Pool-Start teurer wäre als die Arbeit.
+    """
+    song_lists = [[{k: s.get(k, "") for _, k in DATA_FIELDS} for s in songs] for songs in song_lists]
+    workers = workers or min(os.cpu_count() or 1, 8)
+    if workers <= 1 or len(song_lists) < 4:
+        tpl = CompiledTemplate(template_bytes)
+        return [tpl.render(songs).getvalue() for songs in song_lists]
+    # spawn statt fork: der Streamlit-Server hat bereits Threads laufen
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(template_bytes,)) as pool:
+        return list(pool.map(_render_job, song_lists, chunksize=max(1, len(song_lists) // (workers * 4))))
@@ -0,0 +1,84 @@
+"""Komplett-Export des Archivs: alle Events mit aufgelösten Setlist-Zeilen, als Excel oder CSV.
+
+Die Zeilen entstehen per Generator Event für Event und gehen direkt in den Writer.
+openpyxl hält im write-only-Modus keine Zellobjekte, und die Datei landet in einer
+temporären Datei statt in einem BytesIO: der Speicherbedarf bleibt flach, egal ob es
+hundert oder zehntausend Events sind.
+"""
+import csv
+import io
+import tempfile
+
+import openpyxl
+import pandas as pd
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+import db
+import metrics
+import stats
+
+EVENT_FIELDS = ['Event_ID', 'Datum', 'Uhrzeit', 'Ensemble', 'Location_Name', 'Strasse', 'PLZ', 'Stadt', 'Setlist_Name', 'File_Link']
+SONG_FIELDS = ['Titel', 'Komponist_Nachname', 'Komponist_Vorname', 'Bearbeiter_Nachname', 'Bearbeiter_Vorname', 'Dauer', 'Verlag', 'Werkeart', 'ISWC']
+
+EVENT_HEADER = EVENT_FIELDS + ['Anzahl Titel', 'Gesamtdauer']
+SETLIST_HEADER = ['Event_ID', 'Datum', 'Ensemble', 'Location_Name', 'Pos', 'Werk-ID'] + SONG_FIELDS
+CSV_HEADER = EVENT_FIELDS + ['Pos', 'Werk-ID'] + SONG_FIELDS
+
+def _events(df_events):
+    """Events chronologisch (ohne gültiges Datum am Ende) als Dicts, eins nach dem anderen."""
+    if df_events.empty: return
+    df = df_events.sort_values('Datum_Obj', kind='stable', na_position='last') if 'Datum_Obj' in df_events else df_events
+    cols = [c for c in EVENT_FIELDS + ['Songs_IDs'] if c in df.columns]
+    for values in zip(*(df[c].tolist() for c in cols)): yield dict(zip(cols, values))
+
+def rows(df_events, rep_idx):
+    """Generator über (Event-Zeile, [Setlist-Zeilen]); unbekannte Werk-IDs bleiben mit leeren Feldern drin."""
+    secs = stats.seconds(pd.Series([r.get('Dauer', '') for r in rep_idx.records], dtype=object)).tolist() if len(rep_idx) else []
+    durations = {sid: secs[pos] for sid, pos in rep_idx.by_id.items()}
+    for e in _events(df_events):
+        ids = [db._norm_id(s) for s in str(e.get('Songs_IDs', '')).split(',') if s.strip()]
+        songs = [[pos, sid] + [(rep_idx.row_by_id(sid) or {}).get(f, '') for f in SONG_FIELDS] for pos, sid in enumerate(ids, start=1)]
+        event = [e.get(f, '') for f in EVENT_FIELDS]
+        yield event + [len(ids), stats.duration_text(sum(durations.get(sid, 0) for sid in ids))], (event, songs)
+
+def _header(ws, names):
+    bold = Font(bold=True)
+    cells = []
+    for name in names:
+        cell = WriteOnlyCell(ws, value=name); cell.font = bold; cells.append(cell)
+    ws.append(cells)
+
+def write_xlsx(df_events, rep_idx, fh):
+    """Arbeitsmappe mit den Blättern 'Events' und 'Setlists' (eine Zeile pro gespieltem Werk)."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws_events = wb.create_sheet("Events"); ws_songs = wb.create_sheet("Setlists")
+    _header(ws_events, EVENT_HEADER); _header(ws_songs, SETLIST_HEADER)
+    n = 0
+    with metrics.span("export.xlsx"):
+        for event_row, (event, songs) in rows(df_events, rep_idx):
+            ws_events.append(event_row)
+            head = [event[0], event[1], event[3], event[4]]
+            # leere Felder als None: openpyxl schreibt dafür gar keine Zelle
+            for song in songs: ws_songs.append([v if v != '' else None for v in head + song])
+            n += len(songs)
+        wb.save(fh)
+    metrics.count("export.lines", n)
+
+def write_csv(df_events, rep_idx, fh):
+    """Eine flache Tabelle: pro gespieltem Werk eine Zeile mit allen Event-Feldern (Events ohne Titel einmal leer)."""
+    text = io.TextIOWrapper(fh, encoding='utf-8-sig', newline='', write_through=True)
+    writer = csv.writer(text, delimiter=';')
+    writer.writerow(CSV_HEADER)
+    with metrics.span("export.csv"):
+        for _, (event, songs) in rows(df_events, rep_idx):
+            if not songs: writer.writerow(event); continue
+            for song in songs: writer.writerow(event + song)
+    text.detach()
+
+def to_file(write, df_events, rep_idx):
+    """Schreibt per ``write_xlsx``/``write_csv`` in eine temporäre Datei und gibt sie zurückgespult zurück."""
+    fh = tempfile.TemporaryFile()
+    write(df_events, rep_idx, fh)
+    fh.seek(0)
+    return fh
@@ -0,0 +1,97 @@
+"""Leichtgewichtige Messpunkte für die heißen Pfade.
+
+* ``span(name)`` misst eine Dauer, ``count(name)`` zählt (z.B. API-Calls, Cache-Hits).
+* Alles landet in einem prozessweiten Speicher mit den letzten ``KEEP`` Werten pro Name,
+  daraus berechnet ``summary`` die Perzentile für die Admin-Seite.
+* Solange ein Rerun läuft (``begin_run``/``end_run``), werden Spans und Zähler zusätzlich
+  dem Rerun zugeordnet und am Ende als eine JSON-Logzeile ausgegeben.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+KEEP = 1000
+
+log = logging.getLogger("gema.metrics")
+
+_lock = threading.Lock()
+_durations = defaultdict(lambda: deque(maxlen=KEEP))
+_counters = defaultdict(int)
+_runs = deque(maxlen=500)
+_local = threading.local()
+
+
+class Run:
+    """Spans und Zähler eines einzelnen Reruns."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.start = time.perf_counter()
+        self.spans = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.done = False
+
+
+def record(name, ms):
+    with _lock: _durations[name].append(ms)
+    run = getattr(_local, "run", None)
+    if run is not None: run.spans[name] += ms
+
+def count(name, n=1):
+    with _lock: _counters[name] += n
+    run = getattr(_local, "run", None)
+    if run is not None: run.counters[name] += n
+
+@contextmanager
+def span(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - t0) * 1000)
+
+# --- RERUNS ---
+
+def begin_run(previous=None, **fields):
+    """Startet einen Rerun; ein vorheriger, nie beendeter Rerun (``st.rerun``/``st.stop``) wird abgeschlossen."""
+    if previous is not None and not previous.done: end_run(previous)
+    run = _local.run = Run(**fields)
+    return run
+
+def end_run(run, **fields):
+    """Schließt den Rerun ab und schreibt ihn als eine strukturierte JSON-Logzeile."""
+    if run.done: return None
+    run.done = True
+    run.fields.update(fields)
+    entry = dict(run.fields)
+    entry["ms"] = round((time.perf_counter() - run.start) * 1000, 1)
+    entry["api_calls"] = run.counters.get("api.calls", 0)
+    entry["spans"] = {k: round(v, 1) for k, v in run.spans.items()}
+    entry["counters"] = dict(run.counters)
+    with _lock: _runs.append(entry)
+    if getattr(_local, "run", None) is run: _local.run = None
+    log.info(json.dumps({"event": "rerun", **entry}, ensure_ascii=False, default=str))
+    return entry
+
+# --- AUSWERTUNG ---
+
+def summary():
+    """Pro Messpunkt: Anzahl und p50/p95/p99/max in Millisekunden."""
+    with _lock: items = {k: list(v) for k, v in _durations.items()}
+    rows = []
+    for name, values in sorted(items.items()):
+        if not values: continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        rows.append({"Messpunkt": name, "n": len(values), "p50 ms": round(p50, 1), "p95 ms": round(p95, 1), "p99 ms": round(p99, 1), "max ms": round(max(values), 1)})
+    return rows
+
+def counters():
+    with _lock: return dict(sorted(_counters.items()))
+
+def recent_runs():
+    with _lock: return list(_runs)
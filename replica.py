@@ -0,0 +1,77 @@
+"""Lokale SQLite-Replika der Tabelle als Speicher-Backend für ``db.Snapshot``.
+
+Pro Blatt eine Tabelle (Zeilennummer wie in Sheets, ID, Rohwerte als JSON) mit Index auf
+der ID, dazu eine ``meta``-Tabelle mit Tabellen-ID und Drive-Version des letzten Loads.
+Nach einem Neustart baut der Snapshot seine DataFrames aus der Replika und prüft nur noch
+die Version; stimmt sie, fällt kein einziger Sheets-Read an.
+
+Geschrieben werden nur Zeilen, die sich gegenüber dem vorherigen Stand geändert haben, nach
+einem eigenen Append/Update per ``write_row`` sogar nur diese eine Zeile. Jedes andere Objekt
+mit ``read``/``write_rows``/``write_row``/``set_revision`` taugt ebenso als Backend.
+"""
+import json
+import sqlite3
+import threading
+
+import metrics
+
+
+class SqliteReplica:
+
+    def __init__(self, path, sheets):
+        self.path = path
+        self.sheets = list(sheets)
+        self._lock = threading.Lock()
+        # Zugriff aus Upload-Threads, daher eine Verbindung mit eigenem Lock
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._con as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            for name in self.sheets:
+                con.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (row INTEGER PRIMARY KEY, id TEXT, cells TEXT NOT NULL)')
+                con.execute(f'CREATE INDEX IF NOT EXISTS "{name}_id" ON "{name}" (id)')
+
+    def _meta(self, key):
+        row = self._con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def read(self, source):
+        """(revision, {blatt: rohwerte}) für die Tabelle ``source``; (None, {}) wenn leer oder fremd."""
+        with self._lock, metrics.span("replica.read"):
+            if self._meta("source") != str(source): return None, {}
+            values = {}
+            for name in self.sheets:
+                rows = self._con.execute(f'SELECT row, cells FROM "{name}" ORDER BY row').fetchall()
+                out = []
+                for row, cells in rows:
+                    while len(out) < row - 1: out.append([])
+                    out.append(json.loads(cells))
+                values[name] = out
+            return self._meta("revision"), values
+
+    def write_rows(self, source, name, old, new):
+        """Gleicht das Blatt ``name`` von ``old`` auf ``new`` ab: nur geänderte Zeilen werden geschrieben."""
+        changed = [(i + 1, str(r[0]).strip() if r else "", json.dumps(r, ensure_ascii=False))
+                   for i, r in enumerate(new) if i >= len(old) or old[i] != r]
+        with self._lock, metrics.span("replica.write"), self._con as con:
+            if not old:
+                con.execute(f'DELETE FROM "{name}"')
+                con.execute("INSERT OR REPLACE INTO meta VALUES ('source', ?)", (str(source),))
+            con.executemany(f'INSERT OR REPLACE INTO "{name}" VALUES (?, ?, ?)', changed)
+            if len(new) < len(old): con.execute(f'DELETE FROM "{name}" WHERE row > ?', (len(new),))
+        metrics.count("replica.rows_written", len(changed))
+
+    def write_row(self, source, name, row, cells):
+        """Schreibt nur die Zeile ``row`` (1-basiert) des Blatts ``name``."""
+        with self._lock, metrics.span("replica.write"), self._con as con:
+            con.execute(f'INSERT OR REPLACE INTO "{name}" VALUES (?, ?, ?)',
+                        (row, str(cells[0]).strip() if cells else "", json.dumps(cells, ensure_ascii=False)))
+        metrics.count("replica.rows_written")
+
+    def set_revision(self, revision):
+        with self._lock, self._con as con:
+            con.execute("INSERT OR REPLACE INTO meta VALUES ('revision', ?)", (revision,))
+
+    def close(self):
+        with self._lock: self._con.close()
@@ -0,0 +1,87 @@
+"""Repertoire-Index: Label/ID-Lookups und Präfix-Suche über Titel, Komponist und Bearbeiter.
+
+Wird einmal pro Repertoire-Version gebaut. Statt alle Labels an den Browser zu schicken,
+liefert ``search`` nur die besten Treffer für das, was gerade getippt wurde.
+"""
+import re
+import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+
+# Feld -> Gewicht im Ranking (Titel zählt doppelt)
+SEARCH_FIELDS = {'Titel': 2, 'Komponist_Nachname': 1, 'Komponist_Vorname': 1, 'Bearbeiter_Nachname': 1, 'Bearbeiter_Vorname': 1}
+
+def normalize(text):
+    """Kleinschreibung ohne Akzente, ß -> ss; 'Dvořák' findet man also auch mit 'dvorak'."""
+    text = str(text)
+    if text.isascii(): return text.lower()
+    text = unicodedata.normalize("NFKD", str(text).lower().replace("ß", "ss"))
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+@lru_cache(maxsize=65536)
+def _tokens(text):
+    return tuple(re.findall(r"[a-z0-9]+", normalize(text)))
+
+def tokenize(text):
+    # Namen wiederholen sich im Katalog ständig, daher der Cache
+    return _tokens(str(text))
+
+
+class RepertoireIndex:
+    """Label→Zeile, ID→Zeile und ein sortierter Token-Index für Präfix-Suche per ``bisect``."""
+
+    def __init__(self, df_rep):
+        cols = list(df_rep.columns)
+        self.records = [dict(zip(cols, row)) for row in zip(*(df_rep[c].tolist() for c in cols))] if not df_rep.empty else []
+        self.labels = [str(r.get('Label', '')) for r in self.records]
+        self.by_label = {}
+        self.by_id = {}
+        entries = set()
+        for pos, r in enumerate(self.records):
+            self.by_label.setdefault(self.labels[pos], pos)
+            self.by_id.setdefault(str(r.get('ID', '')), pos)
+            for field, weight in SEARCH_FIELDS.items():
+                for tok in tokenize(r.get(field, '')): entries.add((tok, pos, weight))
+        self._entries = sorted(entries)
+        self._keys = [e[0] for e in self._entries]
+        self._norm = [normalize(l) for l in self.labels]
+        self._sorted = sorted(range(len(self.labels)), key=self._norm.__getitem__)
+
+    def __len__(self):
+        return len(self.records)
+
+    def row(self, label):
+        pos = self.by_label.get(label)
+        return None if pos is None else self.records[pos]
+
+    def row_by_id(self, song_id):
+        pos = self.by_id.get(str(song_id))
+        return None if pos is None else self.records[pos]
+
+    def labels_for_ids(self, ids):
+        """Labels in der Reihenfolge der IDs (= Reihenfolge der Setlist); Unbekanntes fällt weg."""
+        return [self.labels[self.by_id[i]] for i in ids if i in self.by_id]
+
+    def _matches(self, q):
+        """pos -> bestes Gewicht aller Tokens, die mit ``q`` beginnen (exakter Treffer +1)."""
+        hits = {}
+        i = bisect_left(self._keys, q)
+        while i < len(self._keys) and self._keys[i].startswith(q):
+            tok, pos, weight = self._entries[i]
+            score = weight + (1 if tok == q else 0)
+            if score > hits.get(pos, 0): hits[pos] = score
+            i += 1
+        return hits
+
+    def search(self, query, limit=50):
+        """Top-``limit`` Labels, die zu allen Suchwörtern passen; leere Suche = alphabetisch."""
+        q_tokens = tokenize(query or "")
+        if not q_tokens: return [self.labels[p] for p in self._sorted[:limit]]
+        scores = None
+        for q in dict.fromkeys(q_tokens):
+            hits = self._matches(q)
+            if scores is None: scores = hits
+            else: scores = {p: s + hits[p] for p, s in scores.items() if p in hits}
+            if not scores: return []
+        best = sorted(scores, key=lambda p: (-scores[p], self._norm[p]))
+        return [self.labels[p] for p in best[:limit]]
@@ -0,0 +1,53 @@
+"""Eine Setlist fertigstellen, ohne Streamlit: Template, Excel, Events-Zeile, Upload samt File_Link.
+
+Die App reicht ihre gecachten Ressourcen (``DriveCache``, ``UploadQueue``, ``Snapshot``) herein,
+``bench.run`` dieselben Bausteine gegen die Fakes; gemessen wird also genau der App-Code.
+"""
+import functools
+
+import db
+import drive
+import excel
+import metrics
+
+FILE_LINK_COL = db.HEADERS["Events"].index('File_Link') + 1
+
+def append_event(snap, data):
+    """Hängt eine Events-Zeile an und gibt ihre endgültige ID zurück."""
+    batch = db.Batch(snap)
+    placeholder = batch.insert("Events", data)
+    batch.flush(); return batch.final_id("Events", placeholder)
+
+def set_file_link(snap, eid, link):
+    """Läuft im Upload-Thread, daher mit explizitem Snapshot."""
+    batch = db.Batch(snap)
+    batch.update("Events", eid, [link], start_col=FILE_LINK_COL)
+    batch.flush()
+
+def generate(dc, uploader, snap, template_file_id, songs_list, target_filename, save_event=None):
+    """
+    Generiert die Setlist und startet den Drive-Upload im Hintergrund.
+    ``save_event(file_link)`` schreibt vorher die Events-Zeile und gibt deren ID zurück (None,
+    wenn sie nicht geschrieben wurde); der fertige Link landet danach per Hintergrund-Job in ``File_Link``.
+    Rückgabe: (BytesIO, Upload-Job-ID, Fehler). Scheitert nur die Events-Zeile, kommt die
+    fertige Datei trotzdem zurück, aber ohne Upload.
+    """
+    try:
+        with metrics.span("generate.template"): tpl = excel.compiled_template(dc.template_key(template_file_id), lambda: dc.template_bytes(template_file_id))
+    except Exception as e: return None, None, f"Download Fehler: {e}"
+
+    try:
+        with metrics.span("generate.render"): output_bytes = tpl.render(songs_list)
+    except Exception as e:
+        return None, None, f"Excel Fehler: {e}"
+
+    on_done = None
+    if save_event:
+        try:
+            with metrics.span("generate.events_write"): eid = save_event(drive.UPLOAD_PENDING)
+        except Exception as e: return output_bytes, None, f"Event nicht gespeichert: {e}"
+        # ohne Events-Zeile kein Upload: der Link hätte kein Ziel, und ein neuer Versuch lädt ohnehin erneut hoch
+        if eid is None: return output_bytes, None, "Event nicht gespeichert (Details im Log)."
+        on_done = functools.partial(set_file_link, snap, eid)
+    job = uploader.submit(output_bytes.getvalue(), target_filename, excel.XLSX_MIME, on_done)
+    return output_bytes, job, None
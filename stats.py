@@ -0,0 +1,139 @@
+"""GEMA-Nutzungsstatistik: Aufführungen und Spieldauer je Werk, Jahr, Ensemble und Ort.
+
+``explode`` zerlegt die ``Songs_IDs`` aller Events vektorisiert in eine Event×Werk-Tabelle.
+``UsageStats`` hält daraus Zähler je (Werk, Jahr, Ensemble, Ort) und folgt dem Snapshot über
+``Snapshot.changes_since``: wird ein einzelnes Event gespeichert oder angehängt, wird nur
+dieses Event neu verbucht statt das ganze Archiv. Die Dauer kommt erst im Bericht aus dem
+Repertoire dazu, Korrekturen dort wirken also ohne Neuberechnung.
+"""
+import threading
+from collections import Counter
+from io import BytesIO
+
+import pandas as pd
+
+import metrics
+
+DIMENSIONS = ['Jahr', 'Ensemble', 'Ort']
+KEYS = ['Song_ID'] + DIMENSIONS
+
+def _ids(s):
+    # wie ``clean_id_list_from_string`` bzw. ``db._norm_id``
+    return s.astype(str).str.strip().str.replace('.0', '', regex=False)
+
+def explode(df_events):
+    """Eine Zeile pro gespieltem Titel (Event_ID, Pos, Song_ID, Jahr, Ensemble, Ort); Events ohne gültiges Datum fehlen."""
+    cols = ['Event_ID', 'Pos'] + KEYS
+    if df_events.empty or 'Songs_IDs' not in df_events.columns or 'Datum_Obj' not in df_events.columns:
+        return pd.DataFrame(columns=cols)
+    df = df_events[df_events['Datum_Obj'].notna()]
+    lines = pd.DataFrame({
+        'Event_ID': _ids(df['Event_ID']),
+        'Jahr': df['Datum_Obj'].dt.year.astype(int),
+        'Ensemble': df['Ensemble'].astype(str) if 'Ensemble' in df else "",
+        'Ort': df['Location_Name'].astype(str) if 'Location_Name' in df else "",
+        'Song_ID': df['Songs_IDs'].astype(str).str.split(','),
+    }).explode('Song_ID', ignore_index=True)
+    lines['Song_ID'] = _ids(lines['Song_ID'].fillna(''))
+    lines = lines[lines['Song_ID'] != ''].reset_index(drop=True)
+    lines['Pos'] = lines.groupby('Event_ID', sort=False).cumcount() + 1
+    return lines[cols]
+
+def seconds(dauer):
+    """'mm:ss', 'h:mm:ss' oder reine Minuten -> Sekunden (vektorisiert, Unlesbares = 0)."""
+    parts = dauer.astype(str).str.strip().str.extract(r'^(?:(\d+):(?=\d+:))?(\d+)(?::(\d{1,2}))?$').astype(float).fillna(0)
+    return (parts[0] * 3600 + parts[1] * 60 + parts[2]).astype(int)
+
+def duration_text(s):
+    return f"{s // 3600}:{s % 3600 // 60:02d}:{s % 60:02d}"
+
+def hms(secs):
+    return secs.map(duration_text)
+
+
+class UsageStats:
+
+    def __init__(self):
+        self.version = None
+        self._plays = Counter()
+        self._events = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signatures(lines):
+        """Event_ID -> ((Jahr, Ensemble, Ort), Song-IDs in Setlist-Reihenfolge)."""
+        songs = {}
+        # ein Durchgang über die Spalten ist hier deutlich schneller als groupby(...).agg(tuple)
+        for eid, song in zip(lines['Event_ID'].tolist(), lines['Song_ID'].tolist()): songs.setdefault(eid, []).append(song)
+        dims = lines.drop_duplicates('Event_ID')
+        return {eid: (tuple(d), tuple(songs[eid])) for eid, *d in zip(*(dims[c].tolist() for c in ['Event_ID'] + DIMENSIONS))}
+
+    def _rebuild(self, df_events):
+        lines = explode(df_events)
+        self._plays = Counter(lines.groupby(KEYS, sort=False).size().to_dict()) if not lines.empty else Counter()
+        self._events = self._signatures(lines)
+
+    def _apply(self, df_rows):
+        """Verbucht die Events in ``df_rows`` neu: alten Beitrag abziehen, neuen addieren."""
+        new = self._signatures(explode(df_rows))
+        for eid in _ids(df_rows['Event_ID']):
+            old = self._events.pop(eid, None)
+            if old:
+                for song in old[1]:
+                    key = (song, *old[0])
+                    self._plays[key] -= 1
+                    if self._plays[key] <= 0: del self._plays[key]
+            if eid in new:
+                self._events[eid] = new[eid]
+                for song in new[eid][1]: self._plays[(song, *new[eid][0])] += 1
+
+    def sync(self, snap):
+        """Holt den Events-Stand des Snapshots nach; gibt sich selbst zurück."""
+        snap.refresh()
+        with self._lock:
+            version, rows, incremental = snap.changes_since("Events", self.version)
+            if version == self.version: return self
+            if incremental:
+                with metrics.span("stats.apply"): self._apply(rows)
+                metrics.count("stats.incremental")
+            else:
+                with metrics.span("stats.rebuild"): self._rebuild(rows)
+            self.version = version
+        return self
+
+    def years(self):
+        with self._lock: return sorted({k[1] for k in self._plays}, reverse=True)
+
+    def report(self, df_rep, by=('Jahr',), years=None):
+        """Aufführungen und Gesamtdauer je Werk und den Dimensionen ``by``, meistgespielt zuerst."""
+        by = [d for d in DIMENSIONS if d in by]
+        with self._lock: items = [(*k, n) for k, n in self._plays.items()]
+        counts = pd.DataFrame(items, columns=KEYS + ['Aufführungen'])
+        if years: counts = counts[counts['Jahr'].isin(years)]
+        counts = counts.groupby(['Song_ID'] + by, as_index=False)['Aufführungen'].sum()
+
+        rep = pd.DataFrame({'Song_ID': _ids(df_rep['ID'])}) if not df_rep.empty else pd.DataFrame(columns=['Song_ID'])
+        for col, parts in [('Komponist', ['Komponist_Nachname', 'Komponist_Vorname']), ('Bearbeiter', ['Bearbeiter_Nachname', 'Bearbeiter_Vorname'])]:
+            names = [df_rep[p].astype(str) for p in parts if p in df_rep]
+            rep[col] = (names[0] + (", " + names[1]).where(names[1] != "", "")) if len(names) == 2 else ""
+        for col in ['Titel', 'Verlag', 'ISWC']: rep[col] = df_rep[col].astype(str) if col in df_rep else ""
+        rep['Dauer'] = seconds(df_rep['Dauer']) if 'Dauer' in df_rep else 0
+        rep = rep.drop_duplicates('Song_ID')
+
+        out = counts.merge(rep, on='Song_ID', how='left')
+        out['Dauer'] = out['Dauer'].fillna(0).astype(int)
+        out['Gesamtdauer'] = hms(out['Dauer'] * out['Aufführungen'])
+        out['Dauer'] = hms(out['Dauer'])
+        out = out.sort_values(by + ['Aufführungen', 'Titel'], ascending=[d != 'Jahr' for d in by] + [False, True], kind='stable')
+        return out[['Song_ID', 'Titel', 'Komponist', 'Bearbeiter', 'Verlag', 'ISWC'] + by + ['Aufführungen', 'Dauer', 'Gesamtdauer']].rename(columns={'Song_ID': 'Werk-ID'}).reset_index(drop=True)
+
+# --- EXPORT ---
+
+def to_xlsx(report):
+    buf = BytesIO()
+    report.to_excel(buf, index=False, sheet_name="GEMA-Statistik")
+    return buf.getvalue()
+
+def to_csv(report):
+    # Semikolon und BOM, damit Excel mit deutschen Einstellungen die Datei direkt öffnet
+    return report.to_csv(sep=';', index=False).encode('utf-8-sig')